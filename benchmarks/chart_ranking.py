@@ -0,0 +1,68 @@
+"""Time the chart ranking engine against the previous per-chart dict approach.
+
+Usage: python benchmarks/chart_ranking.py [sizes...]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ranking import CHARTS, build_snapshots, rank_charts  # noqa: E402
+
+
+def make_rows(size):
+    rows = []
+    for chart in CHARTS:
+        for song_id in range(1, size + 1):
+            views = random.randint(0, 10_000_000)
+            rows.append((chart, song_id, views, random.randint(0, 100_000), song_id))
+    return rows
+
+
+def legacy(rows, song_views, charts):
+    """What update_charts did per chart: ORDER BY, dict per row, loop per song."""
+    results = {}
+    for chart in charts:
+        order = 2 if chart == "total" else 3
+        chart_datas = sorted(
+            ({"song_id": r[1], "views": r[2], "increase": r[3]} for r in rows if r[0] == chart),
+            key=lambda row: row["views" if order == 2 else "increase"],
+            reverse=True,
+        )
+        infos = {
+            data["song_id"]: {"views": data["views"], "current_rank": idx + 1}
+            for idx, data in enumerate(chart_datas)
+        }
+        chart_rows = []
+        for song_id, views in song_views:
+            if song_id in infos:
+                info = infos[song_id]
+                chart_rows.append((song_id, views, views - info["views"], info["current_rank"]))
+            else:
+                chart_rows.append((song_id, views, views, 0))
+        results[chart] = chart_rows
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    print(f"{'songs':>8} {'legacy':>10} {'engine':>10}   (all 5 charts)")
+    for size in sizes:
+        rows = make_rows(size)
+        song_views = [(song_id, random.randint(0, 10_000_000)) for song_id in range(1, size + 1)]
+
+        legacy_time = timed(legacy, rows, song_views, CHARTS)
+        engine_time = timed(lambda: rank_charts(build_snapshots(rows), song_views, CHARTS))
+        print(f"{size:>8} {legacy_time:>9.3f}s {engine_time:>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Compare running the stages of an hourly run in sequence and as a graph.
+
+Stages sleep for their given durations, standing in for the sheet sync,
+the view crawl and the chart write, so only the scheduling is measured.
+
+Usage: python benchmarks/pipeline_overlap.py [sheet crawl write seconds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pipeline import Pipeline, Stage  # noqa: E402
+
+
+def sleeper(seconds):
+    def stage(**results):
+        time.sleep(seconds)
+
+    return stage
+
+
+def main():
+    sheet, crawl, write = [float(arg) for arg in sys.argv[1:4]] or [0.5, 2.0, 0.3]
+    stages = [
+        Stage("sheet", sleeper(sheet / 4)),
+        Stage("songs", sleeper(sheet / 4), after=("sheet",)),
+        Stage("keywords", sleeper(sheet / 4), after=("sheet",)),
+        Stage("artists", sleeper(sheet / 4), after=("songs",)),
+        Stage("keyword_song", sleeper(sheet / 4), after=("songs", "keywords")),
+        Stage("crawl", sleeper(crawl)),
+        Stage("charts", sleeper(write), after=("crawl", "songs")),
+    ]
+
+    start = time.perf_counter()
+    for stage in stages:
+        stage.func()
+    sequential = time.perf_counter() - start
+
+    pipeline = Pipeline(stages)
+    start = time.perf_counter()
+    pipeline.run()
+    graph = time.perf_counter() - start
+
+    pipeline.report()
+    print(f"sequential {sequential:.2f}s, graph {graph:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
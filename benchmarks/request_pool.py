@@ -0,0 +1,102 @@
+"""Compare urlopen against the pooled transport on a local HTTPS server.
+
+Usage: python benchmarks/request_pool.py [requests]
+
+Needs the ``openssl`` binary to create a throwaway self-signed certificate.
+"""
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from waktube.pool import ConnectionPool  # noqa: E402
+
+BODY = b'{"videoDetails": {"viewCount": "123456"}}' * 64
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    handshakes = 0
+
+    def setup(self):
+        super().setup()
+        Handler.handshakes += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def run(label, count, send):
+    Handler.handshakes = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        send()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<8} {count} requests  {elapsed:7.3f}s  "
+        f"{elapsed / count * 1000:6.2f} ms/req  {Handler.handshakes} handshakes"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        client_context = ssl.create_default_context(cafile=cert)
+
+        server = ThreadingHTTPServer(("localhost", 0), Handler)
+        server.socket = server_context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://localhost:{server.server_address[1]}/youtubei/v1/player"
+        data = b'{"context": {}}'
+        headers = {"Content-Type": "application/json"}
+
+        def send_urlopen():
+            request = Request(url, data=data, headers=headers, method="POST")
+            urlopen(request, context=client_context).read()  # nosec
+
+        pool = ConnectionPool(ssl_context=client_context)
+
+        def send_pooled():
+            pool.urlopen(url, "POST", headers=headers, data=data).read()
+
+        run("urlopen", count, send_urlopen)
+        run("pooled", count, send_pooled)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Time the compiled sheet row schema against the previous parser loop.
+
+Runs over a synthetic sheet shaped like the song sheet, with one column per
+artist. Also times a full ingest with a cold and with a warm row cache, the
+ingest of an unchanged sheet, and saving plus loading the sheet state, which
+a run pays on top of the ingest after a sync or a restart.
+
+Usage: python benchmarks/sheet_parser.py [rows...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sheet import RowSchema, SheetState, get_sheet_index, ingest_sheet  # noqa: E402
+
+ARTISTS = {f"artist{i}": f"멤버{i}" for i in range(34)}
+COLUMN = {
+    "title": "제목",
+    "url": "링크",
+    "reaction": "리액션",
+    "date": "날짜",
+    "remix": "리믹스",
+    "start": "시작",
+    "end": "끝",
+    "order": "순서",
+    "keyword": "키워드",
+    "significant": "비고",
+    "artists": ARTISTS,
+}
+HEADER = [name for key, name in COLUMN.items() if key != "artists"] + list(ARTISTS.values())
+
+
+def make_sheet(size):
+    rows = []
+    for i in range(size):
+        rows.append(
+            [
+                f"가수{i % 97} x 가수{i % 13} - 노래 {i}",
+                f"https://youtu.be/{i:011d}",
+                random.choice(["0", f"https://youtu.be/r{i:010d}"]),
+                f"{random.randint(18, 23)}.{random.randint(1, 12):02d}.{random.randint(1, 28):02d}",
+                "",
+                random.choice(["", "12"]),
+                random.choice(["", "240"]),
+                f"{i}.{random.randint(0, 99)}",
+                "키워드1, 키워드2",
+                "",
+            ]
+            + [random.choice(["", "", "", "O"]) for _ in ARTISTS]
+        )
+    return [HEADER] + rows
+
+
+def legacy(values):
+    """The parser loop of work() before the row schema."""
+    config = {"column": COLUMN}
+    columns = get_sheet_index(nameRow=values[0])
+    songs = {}
+    artists_songs = {}
+    for row in values[1:]:
+        if row[columns[config["column"]["significant"]]].strip() == "임시삭제":
+            continue
+        url = row[columns[config["column"]["url"]]]
+        if url == "0" or url == "":
+            continue
+        full_title = row[columns[config["column"]["title"]]]
+        try:
+            title = full_title.split(" - ")[1]
+        except IndexError:
+            continue
+        artist = full_title.split(" - ")[0].replace(" x ", ", ")
+        id = url.split("/")[-1]
+        reaction = row[columns[config["column"]["reaction"]]].replace("https://youtu.be/", "")
+        if reaction == "0":
+            reaction = ""
+        try:
+            date = int(row[columns[config["column"]["date"]]].replace(".", ""))
+        except ValueError:
+            continue
+        remix = row[columns[config["column"]["remix"]]]
+        try:
+            start = int(row[columns[config["column"]["start"]]])
+        except ValueError:
+            start = 0
+        try:
+            end = (
+                int(row[columns[config["column"]["end"]]])
+                if row[columns[config["column"]["end"]]] != ""
+                else 0
+            )
+        except ValueError:
+            end = 0
+        order = int(float(row[columns[config["column"]["order"]]].replace(",", "")) * 100)
+        raw_keywords = row[columns[config["column"]["keyword"]]]
+        keywords = raw_keywords.split(",") if raw_keywords else []
+        songs[id] = (title, artist, remix, reaction, date, start, end, order, keywords)
+        for artist_id, name in config["column"]["artists"].items():
+            if artist_id not in artists_songs:
+                artists_songs[artist_id] = []
+            if row[columns[name]] == "":
+                continue
+            artists_songs[artist_id].append(id)
+    return songs
+
+
+def compiled(values):
+    schema = RowSchema(header=values[0], column=COLUMN)
+    return [schema.parse(row) for row in values[1:]]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [50_000]
+    print(
+        f"{'rows':>8} {'legacy':>9} {'schema':>9} {'ingest':>9} {'cached':>9} "
+        f"{'unchanged':>9} {'state':>9}"
+    )
+    for size in sizes:
+        values = make_sheet(size)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sheet_state.json")
+            state = SheetState(path)
+            cold = timed(ingest_sheet, values, COLUMN, state)
+            warm = timed(ingest_sheet, values, COLUMN, state)
+            state.fingerprint = ingest_sheet(values, COLUMN, state).fingerprint
+            unchanged = timed(ingest_sheet, values, COLUMN, state)
+            persist = timed(state.save) + timed(SheetState(path).load)
+        print(
+            f"{size:>8} {timed(legacy, values):>8.3f}s {timed(compiled, values):>8.3f}s "
+            f"{cold:>8.3f}s {warm:>8.3f}s {unchanged:>8.3f}s {persist:>8.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
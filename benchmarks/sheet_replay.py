@@ -0,0 +1,52 @@
+"""Replay recorded song sheet snapshots through the sheet ingest, offline.
+
+Every snapshot is ingested in order with one state carried across them, as
+the hourly runs would, each one synced so unchanged sheets are skipped. The
+ingest time and number of parsed rows are reported. A cold ingest of the first snapshot is given for comparison.
+
+Usage: python benchmarks/sheet_replay.py [snapshot directory]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sheet import SheetState, ingest_sheet  # noqa: E402
+from snapshot import SnapshotStore  # noqa: E402
+
+
+def main():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, "configs", "snapshots")
+    with open(os.path.join(root, "configs", "config.json"), encoding="utf-8") as file:
+        column = json.load(file)["column"]
+
+    store = SnapshotStore(path)
+    stamps = store.stamps("songs")
+    if not stamps:
+        print(f"No song sheet snapshots in {path}.")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        state = SheetState(os.path.join(directory, "sheet_state.json"))
+        print(f"{'snapshot':>12} {'rows':>7} {'parsed':>7} {'ingest':>8}")
+        for index, stamp in enumerate(stamps):
+            values = store.load("songs", stamp)
+            start = time.perf_counter()
+            result = ingest_sheet(values, column, state)
+            elapsed = time.perf_counter() - start
+            if result is not None:
+                state.fingerprint = result.fingerprint
+            parsed = "skipped" if result is None else result.parsed
+            print(f"{stamp:>12} {len(values) - 1:>7} {parsed:>7} {elapsed:>7.3f}s")
+            if index == 0:
+                cold = elapsed
+
+    print(f"cold ingest {cold:.3f}s, {len(stamps)} snapshots replayed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Time an hourly chart write on the SQLite backend.
+
+Compares writing every chart with one statement per row in autocommit mode
+against the backend: WAL, executemany and one transaction for the run.
+
+Usage: python benchmarks/sqlite_charts.py [sizes...]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ranking import CHARTS  # noqa: E402
+from sqlite_backend import SQLitePool  # noqa: E402
+
+INSERT = "INSERT INTO chart_{chart} (song_id, views, increase, last) VALUES (%s, %s, %s, %s)"
+
+
+def make_rows(size):
+    return [
+        (song_id, random.randint(0, 10_000_000), random.randint(0, 100_000), song_id)
+        for song_id in range(1, size + 1)
+    ]
+
+
+def autocommit(path, rows):
+    SQLitePool(path).close()
+    conn = sqlite3.connect(path, isolation_level=None)
+    for chart in CHARTS:
+        conn.execute(f"DELETE FROM chart_{chart}")
+        for row in rows:
+            conn.execute(INSERT.format(chart=chart).replace("%s", "?"), row)
+    conn.close()
+
+
+def backend(path, rows):
+    pool = SQLitePool(path)
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            for chart in CHARTS:
+                cursor.execute(f"DELETE FROM chart_{chart}")
+                cursor.executemany(INSERT.format(chart=chart), rows)
+        conn.commit()
+    pool.close()
+
+
+def timed(func, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        func(os.path.join(directory, "crawler.db"), rows)
+        return time.perf_counter() - start
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1_000, 10_000]
+    print(f"{'songs':>8} {'autocommit':>11} {'backend':>10}   (all 5 charts)")
+    for size in sizes:
+        rows = make_rows(size)
+        print(f"{size:>8} {timed(autocommit, rows):>10.3f}s {timed(backend, rows):>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
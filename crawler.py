@@ -1,25 +1,52 @@
+import asyncio
+import hashlib
 import json
-from pymysql import Connection, connect
-from pymysql.cursors import Cursor, DictCursor
+import math
+import os
+import sys
+from pymysql import Connection
+from database import Backend, Cursor, DatabasePool, MySQLBackend, SSCursor, statement_stats
 import time
-import gspread
 from gspread import Worksheet
 import schedule
+import tempfile
 from datetime import datetime
-from oauth2client.service_account import ServiceAccountCredentials
-from waktube import YouTube
-from typing import Dict, TypedDict, List, Union, Optional, Tuple
-from threading import Thread
-from copy import deepcopy
-from queue import Queue
+from history import append_history, chart_baselines, ensure_history_table, to_hour, views_at
+from sheet import Ingest, SheetState, SongData, ingest_sheet
+from sheet_client import SheetClient, SheetUnavailable
+from snapshot import STAMP_FORMAT, SnapshotStore
+from pipeline import Pipeline, Stage
+from sqlite_backend import SQLiteBackend, SQLitePool
+from ranking import (
+    CHARTS,
+    ChartRow,
+    ChartSnapshot,
+    SNAPSHOT_QUERY,
+    build_snapshots,
+    diff_rows,
+    fingerprint,
+    rank_charts,
+)
+from waktube import fetch_view_count, request
+from waktube.pool import default_pool
+from waktube.hedge import Hedger
+from waktube.innertube import InnerTube
+from waktube.retry import RetryPolicy
+from typing import AsyncIterator, Dict, Iterator, Iterable, NamedTuple, TypedDict, List, Set, Union, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
 
 class Database(TypedDict):
+    backend: str
+    path: str
     host: str
     port: int
     username: str
     password: str
     name: str
+    local_infile: bool
+    pool_size: int
 
 
 class Column(TypedDict):
@@ -36,33 +63,62 @@ class Column(TypedDict):
     artists: Dict[str, str]
 
 
+class Hedge(TypedDict, total=False):
+    percent: float
+    max_ratio: float
+
+
+class Tiers(TypedDict, total=False):
+    hot_views_per_hour: int
+    cold_interval: int
+
+
+class History(TypedDict, total=False):
+    lookback: int
+
+
+class Snapshots(TypedDict, total=False):
+    path: str
+    keep: int
+
+
+class Crawler(TypedDict, total=False):
+    concurrency: int
+    per_host: int
+    request_timeout: float
+    sheet_timeout: float
+    retry_budget: int
+    hedge: Hedge
+    deadline: int
+    tiers: Tiers
+    chart_write_mode: str
+    history: History
+    snapshots: Snapshots
+
+
 class Config(TypedDict):
     database: Database
     column: Column
+    crawler: Crawler
 
 
-class SongData(TypedDict):
-    song_id: str
-    title: str
-    artist: str
-    remix: Optional[str]
-    reaction: Optional[str]
-    date: int
-    start: int
-    end: int
-    order: int
+class SongRecord:
+    """The columns of a stored song the crawler works with.
 
+    The content columns are only kept as a hash, compared against the sheet
+    to tell which songs changed.
+    """
 
-class SelectSongData(TypedDict):
-    id: int
-    song_id: str
-    title: str
-    artist: str
-    remix: Optional[str]
-    reaction: Optional[str]
-    date: int
-    start: int
-    end: int
+    __slots__ = ("id", "song_id", "reaction", "deleted", "hash")
+
+    def __init__(
+        self, id: int, song_id: str, reaction: Optional[str], deleted: bool, hash: str
+    ) -> None:
+        self.id = id
+        self.song_id = song_id
+        self.reaction = reaction
+        self.deleted = deleted
+        self.hash = hash
 
 
 class InsertSongData(TypedDict):
@@ -76,28 +132,58 @@ class InsertSongData(TypedDict):
     end: int
 
 
-class SelectChartData(TypedDict):
-    id: int
+class PreviousViewsData(TypedDict):
     song_id: int
     views: int
     increase: int
-    last: int
-
 
-class CurrentRankInfoData(TypedDict):
-    id: int
-    song_id: int
-    views: int
-    current_rank: int
 
+with open("./configs/config.json", encoding="utf-8-sig") as file:
+    config: Config = json.load(file)
 
-class SelectKeywordData(TypedDict):
-    id: int
-    keyword: str
+SHEET_STATE_PATH = "configs/sheet_state.json"
+REPLAY_DATABASE_PATH = "configs/replay.db"
+REPLAY_SHEET_STATE_PATH = "configs/replay_sheet_state.json"
+SONG_SHEET_URL = "https://docs.google.com/spreadsheets/d/1Qm6ARImDRLWI-j30aJ9nwHou5WvSHgCtqPVyIh69l68"
+LYRICS_SHEET_URL = "https://docs.google.com/spreadsheets/d/1cplAy6pfH_X4W-odwuZgaRVuvEfUI88NOAonSkThRbE"
+
+sheets = SheetClient(
+    keyfile="configs/oauth.json",
+    timeout=config.get("crawler", {}).get("sheet_timeout", 60),
+    store=SnapshotStore(
+        path=config.get("crawler", {}).get("snapshots", {}).get("path", "configs/snapshots"),
+        keep=config.get("crawler", {}).get("snapshots", {}).get("keep", 168),
+    ),
+)
+
+
+def open_backend(database: Database) -> Backend:
+    if database.get("backend", "mysql") == "sqlite":
+        # configs/ is the only directory mounted as a volume, so the database
+        # survives the container being recreated.
+        return SQLiteBackend(
+            SQLitePool(
+                path=database.get("path", "configs/crawler.db"),
+                maxsize=database.get("pool_size", 4),
+            )
+        )
+    return MySQLBackend(
+        DatabasePool(
+            maxsize=database.get("pool_size", 4),
+            host=database["host"],
+            port=database["port"],
+            user=database["username"],
+            password=database["password"],
+            database=database["name"],
+            local_infile=database.get("local_infile", False),
+        ),
+        local_infile=database.get("local_infile", False),
+    )
 
 
-with open("./configs/config.json", encoding="utf-8-sig") as file:
-    config: Config = json.load(file)
+storage = open_backend(config["database"])
+# Kept across runs, so each run only parses the rows edited since the last.
+song_sheet_state = SheetState(SHEET_STATE_PATH).load()
 
 
 def get_artists(conn: Connection) -> Dict[str, List[Union[str, int, None]]]:
@@ -113,13 +199,6 @@ def get_artists(conn: Connection) -> Dict[str, List[Union[str, int, None]]]:
     return data
 
 
-def get_sheet_index(nameRow: List[str]) -> Dict[str, int]:
-    data: Dict[str, int] = {}
-    for idx, value in enumerate(nameRow):
-        data[value] = idx
-    return data
-
-
 def get_charts_to_update(time: datetime) -> List[str]:
     charts: List[str] = ["hourly"]
     if time.day == 1 and time.hour == 0:
@@ -134,87 +213,277 @@ def get_charts_to_update(time: datetime) -> List[str]:
     return charts
 
 
-def get_views(song_id: str, reaction: str, queue: Queue) -> None:
-    count = 0
-    views = 0
-    while True:
-        try:
-            views = YouTube(f"https://youtu.be/{song_id}").views
-            if reaction != "":
-                views += YouTube(f"https://youtu.be/{reaction}").views
-            break
-        except:
-            if count > 5:
-                views = 0
-                print(f"Failed to get {song_id}.")
-                break
-            count += 1
-            pass
+# Every lookup goes to the same innertube host, so the only per-host limit is
+# the size of the keep-alive pool. Lookups beyond it wait for a connection.
+default_pool.maxsize = config.get("crawler", {}).get(
+    "per_host", config.get("crawler", {}).get("concurrency", default_pool.maxsize)
+)
 
-    queue.put((song_id, views))
+# Shared by every view lookup so the hot path skips per-call client setup.
+innertube = InnerTube(
+    hedger=Hedger(**config["crawler"]["hedge"])
+    if "hedge" in config.get("crawler", {})
+    else None,
+    timeout=config.get("crawler", {}).get("request_timeout", 10),
+)
 
 
-def get_views_many(
-    conn: Connection, queue: Queue, songs: List[Tuple[str, str, int]]
-) -> None:
+def get_views(video_id: str, retry: RetryPolicy) -> Optional[int]:
+    try:
+        return retry.call(fetch_view_count, video_id, innertube=innertube)
+    except Exception as e:
+        print(f"Failed to get {video_id}: {e}")
+        return None
+
+
+def song_videos(song: SongRecord) -> Tuple[str, ...]:
+    """Return the videos whose views are summed into the count of ``song``."""
+    if song.reaction:
+        return (song.song_id, song.reaction)
+    return (song.song_id,)
+
+
+def plan_views_fetch(songs: Iterable[SongRecord]) -> Dict[str, Tuple[str, ...]]:
+    """Map every song to the videos whose views are summed into its count."""
+    return {song.song_id: song_videos(song) for song in songs}
+
+
+def sum_planned_views(
+    plan: Dict[str, Tuple[str, ...]],
+    video_views: Dict[str, Optional[int]],
+    fallback: Dict[str, int],
+) -> Tuple[Dict[str, int], List[str]]:
+    """Sum the fetched video views of every song.
+
+    Songs with a video that was not fetched keep their ``fallback`` views and
+    are returned as stale.
+    """
+    all_song_views: Dict[str, int] = {}
+    stale: List[str] = []
+    for song_id, video_ids in plan.items():
+        views = [video_views.get(video_id) for video_id in video_ids]
+        if None in views:
+            all_song_views[song_id] = fallback.get(song_id, 0)
+            stale.append(song_id)
+        else:
+            all_song_views[song_id] = sum(views)
+    return all_song_views, stale
+
+
+class ViewFetcher:
+    """Fetches video view counts with bounded concurrency, yielding as they complete.
+
+    ``concurrency`` caps the number of in-flight lookups for the whole run, so
+    the crawl time depends on it rather than on the size of the catalog. The
+    connections those lookups use are capped separately by the ``per_host``
+    size of the keep-alive pool; with ``per_host`` below ``concurrency`` the
+    extra lookups only wait for a connection.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 32,
+        retry: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.retry = retry or RetryPolicy()
+
+    async def _fetch(
+        self,
+        executor: ThreadPoolExecutor,
+        limit: asyncio.Semaphore,
+        video_id: str,
+    ) -> Tuple[str, Optional[int]]:
+        loop = asyncio.get_running_loop()
+        async with limit:
+            views = await loop.run_in_executor(
+                executor, get_views, video_id, self.retry
+            )
+        return video_id, views
+
+    async def stream(
+        self,
+        video_ids: Iterable[str],
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[str, Optional[int]]]:
+        """Yield ``(video_id, views)`` pairs, starting lookups in the given order.
+
+        Lookups still running at ``deadline`` (an epoch time) are abandoned;
+        they only stop retrying if the retry policy has the same deadline.
+        """
+        # Semaphores have to be created inside the running loop on python 3.9.
+        limit = asyncio.Semaphore(self.concurrency)
+        timeout = None if deadline is None else max(0, deadline - time.time())
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        tasks = [
+            asyncio.ensure_future(self._fetch(executor, limit, video_id))
+            for video_id in video_ids
+        ]
+        try:
+            for task in asyncio.as_completed(tasks, timeout=timeout):
+                try:
+                    yield await task
+                except asyncio.TimeoutError:
+                    print("Crawl deadline reached, abandoning remaining videos.")
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def counters_since(
+    after: Dict[str, float], before: Dict[str, float], keys: Iterable[str]
+) -> Dict[str, float]:
+    return {key: after[key] - before.get(key, 0) for key in keys}
+
+
+async def collect_all_songs_views(
+    songs: Iterable[SongRecord],
+    fallback: Dict[str, int],
+    deadline: Optional[float],
+) -> Tuple[Dict[str, int], List[str]]:
+    crawler_config = config.get("crawler", {})
+    fetcher = ViewFetcher(
+        concurrency=crawler_config.get("concurrency", 32),
+        # Lookups still running at the deadline stop retrying, so they do not
+        # keep calling YouTube while the charts are written.
+        retry=RetryPolicy(budget=crawler_config.get("retry_budget"), deadline=deadline),
+    )
+    plan = plan_views_fetch(songs)
+    video_ids = list(dict.fromkeys(chain.from_iterable(plan.values())))
+    print(f"Fetching {len(video_ids)} distinct videos for {len(plan)} songs.")
+
+    # Hedge and transfer counters cover the whole process, so a crawl reports
+    # the difference from before it started.
+    transfer_before = request.transfer_stats()
+    hedge_before = innertube.hedger.stats() if innertube.hedger else {}
+
+    video_views: Dict[str, Optional[int]] = {}
+    async for video_id, views in fetcher.stream(video_ids, deadline=deadline):
+        video_views[video_id] = views
+
+    print(f"View fetch outcomes: {dict(fetcher.retry.counters)}")
+    if innertube.hedger:
+        hedge_after = innertube.hedger.stats()
+        hedging = counters_since(hedge_after, hedge_before, ("requests", "hedges", "skipped"))
+        hedging["hedge_rate"] = (
+            hedging["hedges"] / hedging["requests"] if hedging["requests"] else 0.0
+        )
+        latency = {key: hedge_after[key] for key in ("p50", "p95", "p99")}
+        print(f"View fetch hedging: {hedging}")
+        print(f"View fetch latency (recent requests): {latency}")
+    transfer_after = request.transfer_stats()
+    print(f"View fetch transfer: {counters_since(transfer_after, transfer_before, transfer_after)}")
+    return sum_planned_views(plan, video_views, fallback)
+
+
+def read_replay_views(
+    songs: Iterable[SongRecord], fallback: Dict[str, int], replay_views: Dict[str, int]
+) -> Tuple[Dict[str, int], List[str]]:
+    """Take views from a recorded run instead of YouTube.
+
+    Songs the recorded run did not fetch keep their ``fallback`` views and
+    are returned as stale, like failed lookups.
+    """
+    all_song_views: Dict[str, int] = {}
+    stale: List[str] = []
     for song in songs:
-        get_views(song_id=song[0], reaction=song[1], queue=queue)
-
+        if song.song_id in replay_views:
+            all_song_views[song.song_id] = replay_views[song.song_id]
+        else:
+            all_song_views[song.song_id] = fallback.get(song.song_id, 0)
+            stale.append(song.song_id)
+    return all_song_views, stale
 
-def get_chart(conn: Connection, chart: str) -> Tuple[SelectChartData]:
-    with conn.cursor(DictCursor) as cursor:
-        order = "views" if chart == "total" else "increase"
-        cursor.execute(f"SELECT * FROM chart_{chart} ORDER BY {order} DESC")
-        chart_datas = cursor.fetchall()
 
-    return chart_datas
+def get_all_songs_views(
+    songs: Iterable[SongRecord],
+    fallback: Dict[str, int],
+    deadline: Optional[float] = None,
+    replay_views: Optional[Dict[str, int]] = None,
+) -> Tuple[Dict[str, int], List[str]]:
+    if replay_views is not None:
+        print("Start getting views from the recorded run.")
+        return read_replay_views(songs=songs, fallback=fallback, replay_views=replay_views)
 
+    print("Start getting views from youtube.")
 
-def get_chart_current_info(
-    chart_datas: Tuple[SelectChartData],
-) -> Dict[str, CurrentRankInfoData]:
-    current_rank_info: Dict[str, CurrentRankInfoData] = {}
-    for idx, chart_data in enumerate(chart_datas):
-        current_rank_info[chart_data["song_id"]] = {
-            "id": chart_data["id"],
-            "song_id": chart_data["song_id"],
-            "views": chart_data["views"],
-            "current_rank": idx + 1,
-        }
-    return current_rank_info
+    return asyncio.run(
+        collect_all_songs_views(songs=songs, fallback=fallback, deadline=deadline)
+    )
 
 
-def get_all_songs_views(
-    conn: Connection, songs: Tuple[SelectSongData]
-) -> Dict[str, int]:
-    print("Start getting views from youtube.")
+def get_chart_snapshots(conn: Connection) -> Dict[str, ChartSnapshot]:
+    with conn.cursor(Cursor) as cursor:
+        cursor.execute(SNAPSHOT_QUERY)
+        return build_snapshots(cursor.fetchall())
 
-    queue = Queue(maxsize=len(songs))
-    all_song_views = {}
-    threads: List[Thread] = []
-    temp_songs: List[Tuple[str, str, int]] = []
 
+def get_previous_views(snapshot: ChartSnapshot) -> Dict[int, PreviousViewsData]:
+    return {
+        song_id: {"song_id": song_id, "views": views, "increase": increase}
+        for song_id, views, increase in zip(
+            snapshot.song_ids, snapshot.views, snapshot.increases
+        )
+    }
+
+
+def plan_refresh(
+    songs: Iterable[SongRecord],
+    previous: Dict[int, PreviousViewsData],
+    daily_increase: Dict[int, int],
+    now: datetime,
+    full: bool,
+) -> Tuple[List[SongRecord], Dict[str, int]]:
+    """Pick the songs to fetch this hour and interpolate the views of the rest.
+
+    Songs gaining at least ``hot_views_per_hour`` views (judged by their last
+    daily increase) are fetched every hour. Colder songs are fetched every
+    ``cold_interval`` hours, staggered by id so each hour gets a similar
+    share, and otherwise advance by their hourly velocity. Everything is
+    fetched when ``full`` is set.
+    """
+    tiers = config.get("crawler", {}).get("tiers", {})
+    hot_views_per_hour = tiers.get("hot_views_per_hour", 0)
+    cold_interval = tiers.get("cold_interval", 1)
+
+    if full or cold_interval <= 1:
+        return list(songs), {}
+
+    hour = int(now.timestamp() // 3600)
+    refresh: List[SongRecord] = []
+    interpolated: Dict[str, int] = {}
     for song in songs:
-        temp_songs.append((song["song_id"], song["reaction"], song["id"]))
+        if song.id not in previous or song.id not in daily_increase:
+            refresh.append(song)
+            continue
 
-        if len(temp_songs) == 30:
-            t = Thread(target=get_views_many, args=(conn, queue, temp_songs))
-            t.start()
-            threads.append(t)
-            temp_songs = []
+        velocity = max(0, daily_increase[song.id]) / 24
+        if velocity >= hot_views_per_hour or (song.id + hour) % cold_interval == 0:
+            refresh.append(song)
+        else:
+            interpolated[song.song_id] = previous[song.id]["views"] + int(velocity)
 
-    if len(temp_songs) != 0:
-        t = Thread(target=get_views_many, args=(conn, queue, temp_songs))
-        t.start()
-        threads.append(t)
+    return refresh, interpolated
 
-    for t in threads:
-        t.join()
 
-    for data in queue.queue:
-        all_song_views[data[0]] = data[1]
+def prioritize_songs(
+    songs: Iterable[SongRecord], previous: Dict[int, PreviousViewsData]
+) -> List[SongRecord]:
+    """Order songs by their last hourly increase, fastest-growing first.
 
-    return all_song_views
+    Songs without a previous chart entry go first, since there is no value
+    to carry forward for them.
+    """
+    return sorted(
+        songs,
+        key=lambda song: previous[song.id]["increase"]
+        if song.id in previous
+        else math.inf,
+        reverse=True,
+    )
 
 
 def check_if_song_exist(conn: Connection, song_id: str) -> bool:
@@ -246,36 +515,20 @@ def create_song(conn: Connection, data: InsertSongData) -> bool:
             return False
 
 
-def update_lyrics() -> None:
+def update_lyrics(backend: Backend) -> None:
     print("Start Update Lyrics.")
 
-    conn = connect(
-        host=config["database"]["host"],
-        port=config["database"]["port"],
-        user=config["database"]["username"],
-        password=config["database"]["password"],
-        database=config["database"]["name"],
-    )
-    print("update_lyrics: Successfully connected to database.")
-
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            "configs/oauth.json",
-            scopes=["https://www.googleapis.com/auth/spreadsheets"],
-        )
-        gc = gspread.authorize(creds)
-
-        spreadsheet = gc.open_by_url(
-            url="https://docs.google.com/spreadsheets/d/1cplAy6pfH_X4W-odwuZgaRVuvEfUI88NOAonSkThRbE"
-        )
-        current = spreadsheet.get_worksheet(0)
-        old = spreadsheet.get_worksheet(1)
-    except:
+        current_song_workers = sheets.fetch(
+            "lyrics_current", LYRICS_SHEET_URL, 0, lambda worksheet: worksheet.col_values(9)
+        )[2:]
+        old_workers_songs_rows = sheets.fetch(
+            "lyrics_old", LYRICS_SHEET_URL, 1, Worksheet.get_all_values
+        )[1:]
+    except SheetUnavailable:
         print("update_lyrics: Failed to update lyrics workers.")
         return
 
-    current_song_workers = current.col_values(9)[2:]
-    old_workers_songs_rows = old.get_all_values()[1:]
     workers: Dict[str, int] = {}
 
     for row in old_workers_songs_rows:
@@ -304,7 +557,8 @@ def update_lyrics() -> None:
     for idx, value in enumerate(pc_lyrics_const + worker_names):
         team_pc_lyrics.append(("가사", value, "lyrics", "member", idx + 1))
 
-    try:
+    with backend.connection() as conn:
+        print("update_lyrics: Successfully connected to database.")
         try:
             with conn.cursor(cursor=Cursor) as cursor:
                 cursor.execute(
@@ -329,180 +583,639 @@ def update_lyrics() -> None:
             conn.rollback()
             print("update_lyrics: query 2 failed.")
             print(e)
-    finally:
-        conn.close()
 
     print("update_lyrics: Successfully updated lyrics workers.")
 
 
-def update_songs(conn: Connection, songs: Dict[str, SongData]) -> Tuple[SelectSongData]:
-    songs_copy = deepcopy(songs)
+SONG_CONTENT_FIELDS = ("title", "artist", "remix", "reaction", "date", "start", "end", "order")
+
+
+def get_song_hash(song: Union[SongData, Dict]) -> str:
+    content = json.dumps([song[field] for field in SONG_CONTENT_FIELDS])
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+SONG_RECORD_CONTENT_COLUMNS = ("title", "artist", "remix", "date", "start", "end", "order")
+SONG_RECORD_QUERY = (
+    "SELECT id, song_id, reaction, deleted_at IS NOT NULL, "
+    + ", ".join(f"`{column}`" for column in SONG_RECORD_CONTENT_COLUMNS)
+    + " FROM song"
+)
+
+
+def iter_song_records(
+    conn: Connection, song_ids: Optional[List[str]] = None
+) -> Iterator[SongRecord]:
+    """Stream stored songs as :class:`SongRecord`, all of them by default.
+
+    Rows are read with an unbuffered cursor and reduced to a record one at a
+    time, so the full rows are never held in memory together.
+    """
+    query, args = SONG_RECORD_QUERY, None
+    if song_ids is not None:
+        query, args = query + " WHERE song_id IN %s", (song_ids,)
+
+    with conn.cursor(SSCursor) as cursor:
+        cursor.execute(query, args)
+        for id, song_id, reaction, deleted, *columns in cursor:
+            content = dict(zip(SONG_RECORD_CONTENT_COLUMNS, columns), reaction=reaction)
+            yield SongRecord(id, song_id, reaction, bool(deleted), get_song_hash(content))
+
+
+def update_songs(
+    conn: Connection, backend: Backend, songs: Dict[str, SongData]
+) -> Tuple[SongRecord, ...]:
+    db_songs: Dict[str, SongRecord] = {
+        db_song.song_id: db_song for db_song in iter_song_records(conn)
+    }
+
+    upsert_songs = [
+        (song["song_id"], *[song[field] for field in SONG_CONTENT_FIELDS])
+        for song_id, song in songs.items()
+        if song_id not in db_songs
+        or db_songs[song_id].deleted
+        or db_songs[song_id].hash != get_song_hash(song)
+    ]
+    deleted_song_ids = [
+        song_id
+        for song_id, db_song in db_songs.items()
+        if song_id not in songs and not db_song.deleted
+    ]
+    changed_song_ids = [song[0] for song in upsert_songs] + deleted_song_ids
+    print(
+        f"update_songs: {len(upsert_songs)} new or changed, "
+        f"{len(deleted_song_ids)} deleted."
+    )
+
+    if not changed_song_ids:
+        return tuple(db_songs.values())
 
     try:
         with conn.cursor(Cursor) as cursor:
-            cursor.execute("SELECT * FROM song")
-            db_songs = cursor.fetchall()
-
-            for db_song in db_songs:
-                if db_song[1] in songs_copy:
-                    song = songs_copy[db_song[1]]
-                    if db_song[12] != None:
-                        cursor.execute(
-                            "UPDATE song SET title=%s, artist=%s, remix=%s, reaction=%s, date=%s, start=%s, end=%s, `order`=%s, `deleted_at` = NULL WHERE song_id=%s",
-                            (
-                                song["title"],
-                                song["artist"],
-                                song["remix"],
-                                song["reaction"],
-                                song["date"],
-                                song["start"],
-                                song["end"],
-                                song["order"],
-                                song["song_id"],
-                            ),
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE song SET title=%s, artist=%s, remix=%s, reaction=%s, date=%s, start=%s, end=%s, `order`=%s WHERE song_id=%s",
-                            (
-                                song["title"],
-                                song["artist"],
-                                song["remix"],
-                                song["reaction"],
-                                song["date"],
-                                song["start"],
-                                song["end"],
-                                song["order"],
-                                song["song_id"],
-                            ),
-                        )
+            if upsert_songs:
+                cursor.executemany(
+                    backend.upsert(
+                        "song",
+                        columns=("song_id", *SONG_CONTENT_FIELDS),
+                        keys=("song_id",),
+                        assignments=("`deleted_at` = NULL",),
+                    ),
+                    upsert_songs,
+                )
+            if deleted_song_ids:
+                cursor.execute(
+                    "UPDATE song SET `deleted_at` = %s WHERE song_id IN %s",
+                    (int(time.time()), deleted_song_ids),
+                )
 
-                    del songs_copy[db_song[1]]
-                else:
-                    if db_song[12] != None:
-                        continue
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
 
-                    cursor.execute(
-                        "UPDATE song SET `deleted_at` = UNIX_TIMESTAMP(CURRENT_TIMESTAMP()) WHERE song_id=%s",
-                        (db_song[1],),
-                    )
+        print("update_songs: query failed.")
+        print(e)
 
-            insert_songs = [tuple(song.values()) for song in songs_copy.values()]
-            cursor.executemany(
-                "INSERT INTO song (song_id, title, artist, remix, reaction, date, start, end, `order`) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)",
-                insert_songs,
+    for db_song in iter_song_records(conn, song_ids=changed_song_ids):
+        db_songs[db_song.song_id] = db_song
+
+    return tuple(db_songs.values())
+
+
+def is_songs_synced(songs: Dict[str, SongData], db_songs: Tuple[SongRecord, ...]) -> bool:
+    """Return whether the stored songs hold exactly the sheet's songs."""
+    live = {song.song_id: song.hash for song in db_songs if not song.deleted}
+    return live.keys() == songs.keys() and all(
+        live[song_id] == get_song_hash(song) for song_id, song in songs.items()
+    )
+
+
+def insert_chart_rows(
+    cursor: Cursor, backend: Backend, table: str, rows: List[Tuple[int, int, int, int]]
+) -> None:
+    """Bulk load chart rows, through LOAD DATA LOCAL INFILE when enabled."""
+    if not backend.local_infile:
+        cursor.executemany(
+            f"INSERT INTO {table} (song_id, views, increase, last) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+        return
+
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv") as file:
+        file.writelines("\t".join(map(str, row)) + "\n" for row in rows)
+        file.flush()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} (song_id, views, increase, last)",
+            (file.name,),
+        )
+
+
+def swap_chart(
+    cursor: Cursor, backend: Backend, chart: str, rows: List[Tuple[int, int, int, int]]
+) -> None:
+    """Load a chart into a staging table and swap it in with one RENAME TABLE.
+
+    Readers keep seeing the previous chart until the rename, which is atomic.
+    The previous chart is kept as chart_{chart}_old for rollback_chart.
+    DDL commits implicitly, so every chart is swapped on its own.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS chart_{chart}_new")
+    cursor.execute(f"CREATE TABLE chart_{chart}_new LIKE chart_{chart}")
+    insert_chart_rows(cursor=cursor, backend=backend, table=f"chart_{chart}_new", rows=rows)
+    cursor.execute(f"DROP TABLE IF EXISTS chart_{chart}_old")
+    cursor.execute(
+        f"RENAME TABLE chart_{chart} TO chart_{chart}_old, chart_{chart}_new TO chart_{chart}"
+    )
+
+
+def get_linked_charts(conn: Connection, charts: List[str]) -> Set[str]:
+    """Return the charts whose tables have foreign keys, in either direction.
+
+    CREATE TABLE ... LIKE does not copy foreign keys and RENAME TABLE moves
+    those pointing at a chart to chart_{chart}_old, so swap_chart would
+    silently drop them.
+    """
+    tables = [f"chart_{chart}" for chart in charts]
+    try:
+        with conn.cursor(Cursor) as cursor:
+            cursor.execute(
+                "SELECT TABLE_NAME, REFERENCED_TABLE_NAME "
+                "FROM information_schema.KEY_COLUMN_USAGE "
+                "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL "
+                "AND (TABLE_NAME IN %s OR REFERENCED_TABLE_NAME IN %s)",
+                (tables, tables),
             )
+            linked = set(chain.from_iterable(cursor.fetchall()))
+    except Exception as e:
+        conn.rollback()
+
+        print("get_linked_charts: query failed, writing every chart in place.")
+        print(e)
+        return set(charts)
+    return {chart for chart in charts if f"chart_{chart}" in linked}
+
+
+def rollback_chart(conn: Connection, chart: str) -> bool:
+    """Swap the chart written by the last swap_chart with the one it replaced.
 
+    The chart's fingerprint is dropped, so the next run writes it again even
+    if its content matches the rolled back chart.
+    """
+    try:
+        with conn.cursor(Cursor) as cursor:
+            cursor.execute(
+                f"RENAME TABLE chart_{chart} TO chart_{chart}_tmp, "
+                f"chart_{chart}_old TO chart_{chart}, chart_{chart}_tmp TO chart_{chart}_old"
+            )
+            cursor.execute("DELETE FROM chart_fingerprint WHERE type = %s", (chart,))
+            cursor.execute(
+                "UPDATE chart_updated SET time = %s WHERE type = %s",
+                (int(time.time()), chart),
+            )
         conn.commit()
     except Exception as e:
         conn.rollback()
 
-        print("update_songs: query failed.")
+        print(f"rollback_chart: rolling back chart {chart} failed.")
         print(e)
+        return False
+    return True
+
+
+class CrawledViews(NamedTuple):
+    snapshots: Dict[str, ChartSnapshot]
+    # Views of every crawled song by video id, fetched or interpolated.
+    views: Dict[str, int]
+    # Videos each crawled song was counted from.
+    videos: Dict[str, Tuple[str, ...]]
+    # Songs whose views were fetched this run.
+    fetched: Set[str]
+    # Cold songs whose views were interpolated. They are recorded in the view
+    # history as well, flagged, which keeps their next hourly increase to one
+    # hour of velocity instead of everything since their last fetch.
+    interpolated: Set[str]
+
+
+def crawl_views(
+    snapshots: Dict[str, ChartSnapshot],
+    songs: Tuple[SongRecord, ...],
+    charts: List[str],
+    deadline: Optional[float] = None,
+    now: Optional[datetime] = None,
+    replay_views: Optional[Dict[str, int]] = None,
+) -> CrawledViews:
+    """Fetch or interpolate the views of ``songs`` for the charts to update.
+
+    Views are read from ``replay_views`` instead of YouTube when given.
+    """
+    previous = get_previous_views(snapshot=snapshots["hourly"])
+    fallback = {
+        song.song_id: previous[song.id]["views"]
+        for song in songs
+        if song.id in previous
+    }
+    # Every chart but hourly and total marks a boundary that needs real counts.
+    full = now is None or any(chart not in ("hourly", "total") for chart in charts)
+    refresh, interpolated = plan_refresh(
+        songs=songs,
+        previous=previous,
+        daily_increase=dict(zip(snapshots["daily"].song_ids, snapshots["daily"].increases)),
+        now=now,
+        full=full,
+    )
+    all_song_views, stale = get_all_songs_views(
+        songs=prioritize_songs(refresh, previous),
+        fallback=fallback,
+        deadline=deadline,
+        replay_views=replay_views,
+    )
+    all_song_views.update(interpolated)
+    print(
+        f"update_charts: fetched {len(refresh) - len(stale)} songs, "
+        f"kept last known views of {len(stale)} songs, "
+        f"interpolated {len(interpolated)} cold songs."
+    )
+    if stale:
+        print(f"update_charts: stale songs: {', '.join(stale)}")
+
+    stale_ids = set(stale)
+    fetched = {song.song_id for song in refresh if song.song_id not in stale_ids}
+    return CrawledViews(
+        snapshots=snapshots,
+        views=all_song_views,
+        videos={song.song_id: song_videos(song) for song in songs},
+        fetched=fetched,
+        interpolated=set(interpolated),
+    )
 
-    with conn.cursor(DictCursor) as cursor:
-        cursor.execute("SELECT * FROM song")
-        results: Tuple[SelectSongData] = cursor.fetchall()
 
-    return results
+def save_views(song_views: Dict[str, int], now: Optional[datetime]) -> None:
+    """Keep the views fetched by a run next to its sheet snapshots, for replay."""
+    if sheets.store is None:
+        return
+    try:
+        sheets.store.save("views", song_views, time=now)
+    except (OSError, TypeError) as e:
+        print(f"Failed to save a snapshot of views: {e}")
 
 
 def update_charts(
-    conn: Connection, songs: Tuple[SelectSongData], charts: List[str]
-) -> None:
+    conn: Connection,
+    backend: Backend,
+    songs: Tuple[SongRecord, ...],
+    charts: List[str],
+    deadline: Optional[float] = None,
+    now: Optional[datetime] = None,
+    crawled: Optional[CrawledViews] = None,
+    replay_views: Optional[Dict[str, int]] = None,
+) -> List[str]:
+    """Rank and write ``charts``, returning those actually written.
+
+    ``crawled`` may come from a crawl started before ``songs`` were synced;
+    songs added or whose videos changed since are fetched here. The fetched
+    views are saved for replay, unless they come from ``replay_views``.
+    """
     print("Start running update_charts.")
-    all_song_views = get_all_songs_views(conn=conn, songs=songs)
-    print("update_charts: successfully fetched all songs views.")
+    if crawled is None:
+        crawled = crawl_views(
+            snapshots=get_chart_snapshots(conn=conn),
+            songs=songs,
+            charts=charts,
+            deadline=deadline,
+            now=now,
+            replay_views=replay_views,
+        )
+
+    all_song_views = dict(crawled.views)
+    fetched = set(crawled.fetched)
+    missing = [song for song in songs if crawled.videos.get(song.song_id) != song_videos(song)]
+    if missing:
+        print(f"update_charts: fetching {len(missing)} songs changed since the crawl.")
+        previous = get_previous_views(snapshot=crawled.snapshots["hourly"])
+        missing_views, stale = get_all_songs_views(
+            songs=missing,
+            fallback={
+                song.song_id: previous[song.id]["views"]
+                for song in missing
+                if song.id in previous
+            },
+            deadline=deadline,
+            replay_views=replay_views,
+        )
+        all_song_views.update(missing_views)
+        fetched.update(song_id for song_id in missing_views if song_id not in stale)
+
+    if replay_views is None:
+        save_views({song_id: all_song_views[song_id] for song_id in fetched}, now=now)
+
+    history = config.get("crawler", {}).get("history")
+    baselines = None
+    if history is not None and now is not None:
+        fresh = [
+            (song.id, all_song_views[song.song_id]) for song in songs if song.song_id in fetched
+        ]
+        # Songs fetched since the crawl are no longer interpolated.
+        estimated = [
+            (song.id, all_song_views[song.song_id])
+            for song in songs
+            if song.song_id in crawled.interpolated and song.song_id not in fetched
+        ]
+        try:
+            with conn.cursor(Cursor) as cursor:
+                ensure_history_table(cursor=cursor, backend=backend, time=now)
+                appended = append_history(
+                    cursor=cursor, backend=backend, hour=to_hour(now), song_views=fresh
+                )
+                appended += append_history(
+                    cursor=cursor,
+                    backend=backend,
+                    hour=to_hour(now),
+                    song_views=estimated,
+                    interpolated=True,
+                )
+                conn.commit()
+                print(f"update_charts: appended {appended} rows to view history.")
+                baselines = chart_baselines(
+                    cursor=cursor,
+                    charts=charts,
+                    time=now,
+                    lookback=history.get("lookback", 168),
+                )
+        except Exception as e:
+            conn.rollback()
+
+            print("update_charts: view history failed, using chart tables.")
+            print(e)
+
+    chart_rows = rank_charts(
+        snapshots=crawled.snapshots,
+        song_views=((song.id, all_song_views[song.song_id]) for song in songs),
+        charts=charts,
+        baselines=baselines,
+    )
+    return write_charts(
+        conn=conn,
+        backend=backend,
+        charts=charts,
+        chart_rows=chart_rows,
+        snapshots=crawled.snapshots,
+    )
+
+
+CHART_FINGERPRINT_TABLE = (
+    "CREATE TABLE IF NOT EXISTS chart_fingerprint ("
+    "type VARCHAR(16) NOT NULL PRIMARY KEY, fingerprint CHAR(32) NOT NULL)"
+)
+
+
+def get_chart_fingerprints(conn: Connection) -> Dict[str, str]:
+    try:
+        with conn.cursor(Cursor) as cursor:
+            cursor.execute(CHART_FINGERPRINT_TABLE)
+            cursor.execute("SELECT type, fingerprint FROM chart_fingerprint")
+            return dict(cursor.fetchall())
+    except Exception as e:
+        conn.rollback()
+
+        print("get_chart_fingerprints: query failed, writing every chart.")
+        print(e)
+        return {}
+
+
+def replace_chart_rows(
+    cursor: Cursor, backend: Backend, chart: str, snapshot: ChartSnapshot, rows: List[ChartRow]
+) -> bool:
+    """Write only the rows of a chart that changed. Returns whether any did."""
+    changed, removed = diff_rows(snapshot, rows)
+    if not changed and not removed:
+        return False
+
+    if len(changed) > len(rows) // 2:
+        cursor.execute(f"DELETE FROM chart_{chart}")
+        insert_chart_rows(cursor=cursor, backend=backend, table=f"chart_{chart}", rows=rows)
+        return True
+
+    stale_ids = removed + [row[0] for row in changed]
+    for start in range(0, len(stale_ids), 1000):
+        cursor.execute(
+            f"DELETE FROM chart_{chart} WHERE song_id IN %s",
+            (stale_ids[start : start + 1000],),
+        )
+    if changed:
+        insert_chart_rows(cursor=cursor, backend=backend, table=f"chart_{chart}", rows=changed)
+    return True
+
+
+def write_charts(
+    conn: Connection,
+    backend: Backend,
+    charts: List[str],
+    chart_rows: Dict[str, List[ChartRow]],
+    snapshots: Dict[str, ChartSnapshot],
+) -> List[str]:
+    """Write the charts whose content changed and return their names.
+
+    A chart whose rows hash to the fingerprint stored by its last write is
+    skipped without touching its table.
+    """
+    write_mode = config.get("crawler", {}).get("chart_write_mode", "delete")
+    if not backend.swappable:
+        # Without swaps, charts are written in place within the transaction.
+        write_mode = "delete"
+    fingerprints = get_chart_fingerprints(conn=conn)
+    linked = get_linked_charts(conn=conn, charts=charts) if write_mode == "swap" else set()
+    if linked:
+        print(
+            f"Charts {', '.join(sorted(linked))} have foreign keys, "
+            "which a swap would drop; writing them in place."
+        )
 
+    written: List[str] = []
     try:
         with conn.cursor(Cursor) as cursor:
             for chart in charts:
-                chart_data = get_chart(conn=conn, chart=chart)
-                current_chart_infos: Dict[
-                    str, CurrentRankInfoData
-                ] = get_chart_current_info(chart_datas=chart_data)
-                chart_input_data = []
-                for song in songs:
-                    views = all_song_views[song["song_id"]]
-                    if song["id"] in current_chart_infos:
-                        current_chart_info = current_chart_infos[song["id"]]
-                        chart_input_data.append(
-                            (
-                                song["id"],
-                                views,
-                                (views - current_chart_info["views"]),
-                                current_chart_info["current_rank"],
-                            )
+                chart_input_data = chart_rows[chart]
+                chart_fingerprint = fingerprint(chart_input_data)
+                if fingerprints.get(chart) == chart_fingerprint:
+                    print(f"Chart {chart} is unchanged, skipped.")
+                    continue
+
+                try:
+                    if write_mode == "swap" and chart not in linked:
+                        swap_chart(
+                            cursor=cursor, backend=backend, chart=chart, rows=chart_input_data
                         )
+                        changed = True
                     else:
-                        chart_input_data.append((song["id"], views, (views - 0), 0))
+                        changed = replace_chart_rows(
+                            cursor=cursor,
+                            backend=backend,
+                            chart=chart,
+                            snapshot=snapshots[chart],
+                            rows=chart_input_data,
+                        )
+                except:
+                    print(f"Failed to insert data to chart {chart}")
+                    continue
 
+                if changed:
+                    written.append(chart)
+                    print(f"Successfully inserted all data to chart {chart}")
+                else:
+                    print(f"Chart {chart} is unchanged, skipped.")
+
+                # Only saves the next run a write, so the chart stays written
+                # even if this fails.
                 try:
-                    cursor.execute(f"DELETE FROM chart_{chart}")
-                    cursor.executemany(
-                        f"INSERT INTO chart_{chart} (song_id, views, increase, last) VALUES (%s, %s, %s, %s)",
-                        chart_input_data,
+                    cursor.execute(
+                        backend.upsert(
+                            "chart_fingerprint", columns=("type", "fingerprint"), keys=("type",)
+                        ),
+                        (chart, chart_fingerprint),
                     )
-                    print(f"Successfully inserted all data to chart {chart}")
-                except:
-                    print(f"Failed to insert data to chart {chart}")
+                except Exception as e:
+                    print(f"Failed to store the fingerprint of chart {chart}.")
+                    print(e)
         conn.commit()
     except Exception as e:
         conn.rollback()
 
         print("update_charts: query failed.")
         print(e)
+        # Swapped charts are live already, since DDL commits implicitly.
+        return written if write_mode == "swap" else []
+
+    return written
+
+
+def recompute_charts(
+    conn: Connection, backend: Backend, charts: List[str], at: datetime
+) -> List[str]:
+    """Rewrite charts as they should have been written at ``at``, from history.
+
+    Meant for recovering from missed or failed runs. Only observed views are
+    used, never interpolated ones. Ranks are still taken from the chart
+    tables as they are now, and songs without observed history in the
+    lookback keep the views the chart tables hold for them. Returns the
+    charts actually written.
+    """
+    lookback = config.get("crawler", {}).get("history", {}).get("lookback", 168)
+    snapshots = get_chart_snapshots(conn=conn)
+    song_views: Dict[int, int] = {}
+    # Least recently written first, so the latest views of a song win.
+    for chart in ("monthly", "weekly", "daily", "total", "hourly"):
+        song_views.update(zip(snapshots[chart].song_ids, snapshots[chart].views))
+    with conn.cursor(Cursor) as cursor:
+        song_views.update(
+            views_at(cursor=cursor, hour=to_hour(at), lookback=lookback, observed=True)
+        )
+        baselines = chart_baselines(
+            cursor=cursor, charts=charts, time=at, lookback=lookback, observed=True
+        )
+
+    chart_rows = rank_charts(
+        snapshots=snapshots, song_views=song_views.items(), charts=charts, baselines=baselines
+    )
+    return write_charts(
+        conn=conn, backend=backend, charts=charts, chart_rows=chart_rows, snapshots=snapshots
+    )
+
+
+def mark_charts_updated(conn: Connection, charts: Iterable[str]) -> None:
+    with conn.cursor(Cursor) as cursor:
+        chart_updated_time = int(time.time())
+        for chart in charts:
+            cursor.execute(
+                "UPDATE chart_updated SET time = %s WHERE type = %s",
+                (chart_updated_time, chart),
+            )
+    conn.commit()
+
+
+def sync_pairs(
+    conn: Connection,
+    table: str,
+    columns: Tuple[str, str],
+    pairs: Set[Tuple[int, int]],
+    chunk_size: int = 1000,
+) -> Tuple[int, int]:
+    """Make a two-column join table hold exactly ``pairs``.
+
+    Only the difference with the current rows is written, and nothing at all
+    when they already match. Returns the number of inserted and deleted pairs.
+    """
+    left, right = columns
+    with conn.cursor(Cursor) as cursor:
+        cursor.execute(f"SELECT `{left}`, `{right}` FROM `{table}`")
+        current = set(cursor.fetchall())
+
+        inserts = list(pairs - current)
+        deletes = list(current - pairs)
+        if not inserts and not deletes:
+            return 0, 0
+
+        for idx in range(0, len(deletes), chunk_size):
+            cursor.execute(
+                f"DELETE FROM `{table}` WHERE (`{left}`, `{right}`) IN %s",
+                (deletes[idx : idx + chunk_size],),
+            )
+        cursor.executemany(
+            f"INSERT INTO `{table}` (`{left}`, `{right}`) VALUES (%s, %s)", inserts
+        )
+
+    return len(inserts), len(deletes)
 
 
 def update_artists(
     conn: Connection,
-    songs: Tuple[SelectSongData],
+    songs: Tuple[SongRecord, ...],
     artists_songs: Dict[str, List[str]],
     artists: Dict[str, int],
-) -> None:
+) -> bool:
     print("Start running update_artists.")
     song_dict = {}
     for song in songs:
-        song_dict[song["song_id"]] = song["id"]
+        song_dict[song.song_id] = song.id
 
-    insert_data = []
+    pairs: Set[Tuple[int, int]] = set()
     for artist_name, song_ids in artists_songs.items():
         artist_id = artists[artist_name]
         for song_id in song_ids:
-            insert_data.append((artist_id, song_dict[song_id]))
+            pairs.add((artist_id, song_dict[song_id]))
     try:
-        with conn.cursor(Cursor) as cursor:
-            cursor.execute("DELETE FROM artist_song")
-            cursor.executemany(
-                "INSERT INTO artist_song (artist_id, song_id) VALUES (%s, %s)",
-                insert_data,
-            )
+        inserted, deleted = sync_pairs(
+            conn=conn, table="artist_song", columns=("artist_id", "song_id"), pairs=pairs
+        )
         conn.commit()
+        print(f"update_artists: {inserted} inserted, {deleted} deleted.")
+        return True
     except Exception as e:
         conn.rollback()
 
         print("update_artists: query failed.")
         print(e)
+        return False
 
 
-def update_keywords(conn: Connection, keywords: List[str]) -> List[str]:
+def update_keywords(conn: Connection, keywords: List[str]) -> Dict[str, int]:
     print("Start running update_keywords.")
-    keywords_copy = deepcopy(keywords)
-    try:
-        with conn.cursor(Cursor) as cursor:
-            cursor.execute("SELECT * FROM `keyword`")
-            db_keywords = cursor.fetchall()
+    with conn.cursor(Cursor) as cursor:
+        cursor.execute("SELECT `id`, `keyword` FROM `keyword`")
+        keyword_ids: Dict[str, int] = {keyword: id for id, keyword in cursor.fetchall()}
 
-            for idx, db_keyword in enumerate(db_keywords):
-                if db_keyword[1] not in keywords_copy:
-                    cursor.execute(
-                        "DELETE FROM `keyword` WHERE `keyword` = %s", (db_keyword[1],)
-                    )
-                else:
-                    del keywords_copy[keywords_copy.index(db_keyword[1])]
+    wanted = set(keywords)
+    stale_keywords = [keyword for keyword in keyword_ids if keyword not in wanted]
+    new_keywords = [keyword for keyword in wanted if keyword not in keyword_ids]
+    if not stale_keywords and not new_keywords:
+        return keyword_ids
 
+    try:
+        with conn.cursor(Cursor) as cursor:
+            if stale_keywords:
+                cursor.execute(
+                    "DELETE FROM `keyword` WHERE `keyword` IN %s", (stale_keywords,)
+                )
             cursor.executemany(
-                "INSERT INTO `keyword` (`keyword`) VALUES (%s)", keywords_copy
+                "INSERT INTO `keyword` (`keyword`) VALUES (%s)", new_keywords
             )
         conn.commit()
     except Exception as e:
@@ -510,237 +1223,375 @@ def update_keywords(conn: Connection, keywords: List[str]) -> List[str]:
 
         print("update_keywords: query failed.")
         print(e)
+        return keyword_ids
 
-    with conn.cursor(DictCursor) as cursor:
-        cursor.execute("SELECT `id`, `keyword` FROM `keyword`")
-        results: Tuple[SelectKeywordData] = cursor.fetchall()
+    for keyword in stale_keywords:
+        del keyword_ids[keyword]
 
-    return results
+    if new_keywords:
+        with conn.cursor(Cursor) as cursor:
+            cursor.execute(
+                "SELECT `id`, `keyword` FROM `keyword` WHERE `keyword` IN %s",
+                (new_keywords,),
+            )
+            for id, keyword in cursor.fetchall():
+                keyword_ids[keyword] = id
+
+    return keyword_ids
 
 
 def update_keyword_song(
     conn: Connection,
-    keywords: List[SelectKeywordData],
+    keywords: Dict[str, int],
     keyword_song: Dict[str, List[str]],
-    songs: Tuple[SelectSongData],
-) -> None:
+    songs: Tuple[SongRecord, ...],
+) -> bool:
     print("Start running update_keyword_song.")
 
     song_dict: Dict[str, int] = {}
     for song in songs:
-        song_dict[song["song_id"]] = song["id"]
+        song_dict[song.song_id] = song.id
 
-    keyword_dict: Dict[str, SelectKeywordData] = {}
-    for keyword in keywords:
-        keyword_dict[keyword["keyword"]] = keyword
-
-    insert_data = []
+    pairs: Set[Tuple[int, int]] = set()
     for keyword, song_ids in keyword_song.items():
-        if keyword not in keyword_dict:
+        if keyword not in keywords:
             continue
-        
-        db_keyword = keyword_dict[keyword]
+
         for song_id in song_ids:
-            insert_data.append((db_keyword["id"], song_dict[song_id]))
+            pairs.add((keywords[keyword], song_dict[song_id]))
     try:
-        with conn.cursor(Cursor) as cursor:
-            cursor.execute("DELETE FROM `keyword_song`")
-            cursor.executemany(
-                "INSERT INTO `keyword_song` (`keyword_id`, `song_id`) VALUES (%s, %s)",
-                insert_data,
-            )
+        inserted, deleted = sync_pairs(
+            conn=conn, table="keyword_song", columns=("keyword_id", "song_id"), pairs=pairs
+        )
         conn.commit()
+        print(f"update_keyword_song: {inserted} inserted, {deleted} deleted.")
+        return True
     except Exception as e:
         conn.rollback()
 
         print("update_keyword_song: query failed.")
         print(e)
+        return False
 
 
-def work() -> None:
-    conn = connect(
-        host=config["database"]["host"],
-        port=config["database"]["port"],
-        user=config["database"]["username"],
-        password=config["database"]["password"],
-        database=config["database"]["name"],
-    )
-    now = datetime.now()
-
+def work(
+    deadline: Optional[float] = None,
+    now: Optional[datetime] = None,
+    sheet_state: Optional[SheetState] = None,
+    replay_views: Optional[Dict[str, int]] = None,
+    backend: Optional[Backend] = None,
+) -> None:
+    """Run every stage of an hourly update, overlapping the independent ones.
+
+    The view crawl of the songs already in the database starts right away,
+    alongside the sheet sync; songs the sync adds are fetched before the
+    charts are written. ``now``, ``sheet_state``, ``replay_views`` and
+    ``backend`` are set by :func:`replay`; runs default to the configured
+    storage and song sheet state.
+    """
+    if backend is None:
+        backend = storage
+    if sheet_state is None:
+        sheet_state = song_sheet_state
+    if deadline is None:
+        deadline = time.time() + config.get("crawler", {}).get("deadline", 3000)
+
+    if now is None:
+        now = datetime.now()
+    statement_stats.reset()
     print(f"Work {now.hour} started.")
-    print("Successfully connected to database.")
-
-    if now.hour == 1:
-        try:
-            lyric_thread = Thread(target=update_lyrics)
-            lyric_thread.start()
-        except:
-            print("Failed to update lyrics.")
+    charts = get_charts_to_update(time=now)
 
-    while True:
+    def read_sheet() -> Optional[Tuple[Ingest, SheetState]]:
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(
-                filename="configs/oauth.json",
-                scopes=["https://www.googleapis.com/auth/spreadsheets"],
+            values = sheets.fetch("songs", SONG_SHEET_URL, 1, Worksheet.get_all_values)
+        except SheetUnavailable as e:
+            print(e)
+            print("Error while loading Google Spreadsheet, keeping the songs in the database.")
+            return None
+        print("Successfully retrieved song spreadsheet.")
+
+        ingest = ingest_sheet(values=values, column=config["column"], state=sheet_state)
+        if ingest is None:
+            print("Song sheet is unchanged, skipping song sync.")
+            return None
+        print(f"Song sheet changed, parsed {ingest.parsed} rows.")
+        return ingest, sheet_state
+
+    def sync_songs(sheet: Optional[Tuple[Ingest, SheetState]]) -> Tuple[SongRecord, ...]:
+        with backend.connection() as conn:
+            if sheet is None:
+                return tuple(iter_song_records(conn))
+            return update_songs(conn=conn, backend=backend, songs=sheet[0].songs)
+
+    def sync_keywords(sheet: Optional[Tuple[Ingest, SheetState]]) -> Dict[str, int]:
+        if sheet is None:
+            return {}
+        with backend.connection() as conn:
+            return update_keywords(conn=conn, keywords=list(sheet[0].keyword_song.keys()))
+
+    def sync_artists(
+        sheet: Optional[Tuple[Ingest, SheetState]], songs: Tuple[SongRecord, ...]
+    ) -> bool:
+        if sheet is None:
+            return True
+        with backend.connection() as conn:
+            return update_artists(
+                conn=conn,
+                songs=songs,
+                artists_songs=sheet[0].artists_songs,
+                artists=get_artists(conn=conn),
             )
-            gc = gspread.authorize(creds)
-            spreadsheet = gc.open_by_url(
-                url="https://docs.google.com/spreadsheets/d/1Qm6ARImDRLWI-j30aJ9nwHou5WvSHgCtqPVyIh69l68"
+
+    def sync_keyword_song(
+        sheet: Optional[Tuple[Ingest, SheetState]],
+        songs: Tuple[SongRecord, ...],
+        keywords: Dict[str, int],
+    ) -> bool:
+        if sheet is None:
+            return True
+        with backend.connection() as conn:
+            return update_keyword_song(
+                conn=conn, keywords=keywords, keyword_song=sheet[0].keyword_song, songs=songs
             )
-            worksheet = spreadsheet.get_worksheet(1)
-            break
-        except Exception as e:
-            print(e)
-            print("Error while loading Google Spreadsheet.")
-            time.sleep(2)
-    print("Successfully retrieved song spreadsheet.")
 
-    values = worksheet.get_all_values()
-    rows = values[1:]
+    def save_sheet_state(
+        sheet: Optional[Tuple[Ingest, SheetState]],
+        songs: Tuple[SongRecord, ...],
+        keywords: Dict[str, int],
+        artists: bool,
+        keyword_song: bool,
+    ) -> None:
+        if sheet is None:
+            return
+        ingest, sheet_state = sheet
+        # Only a fully synced sheet may be skipped next time.
+        synced = (
+            artists
+            and keyword_song
+            and set(keywords) == set(ingest.keyword_song)
+            and is_songs_synced(songs=ingest.songs, db_songs=songs)
+        )
+        if synced:
+            sheet_state.fingerprint = ingest.fingerprint
+            sheet_state.save()
+
+    def crawl() -> CrawledViews:
+        with backend.connection() as conn:
+            snapshots = get_chart_snapshots(conn=conn)
+            songs = tuple(iter_song_records(conn))
+        return crawl_views(
+            snapshots=snapshots,
+            songs=songs,
+            charts=charts,
+            deadline=deadline,
+            now=now,
+            replay_views=replay_views,
+        )
 
-    columns = get_sheet_index(nameRow=values[0])
-    artists = get_artists(conn=conn)
-    charts = get_charts_to_update(time=now)
+    def write(crawl: CrawledViews, songs: Tuple[SongRecord, ...]) -> List[str]:
+        with backend.connection() as conn:
+            return update_charts(
+                conn=conn,
+                backend=backend,
+                songs=songs,
+                charts=charts,
+                deadline=deadline,
+                now=now,
+                crawled=crawl,
+                replay_views=replay_views,
+            )
 
-    songs: Dict[str, SongData] = {}
-    artists_songs: Dict[str, List[str]] = {}
-    keywords = []
-    keyword_song: Dict[str, List[str]] = {}
+    def mark_updated(charts: List[str]) -> None:
+        with backend.connection() as conn:
+            mark_charts_updated(conn=conn, charts=charts)
+        print("Successfully updated wakmusic chart data.")
+
+    def lyrics() -> None:
+        update_lyrics(backend=backend)
+
+    stages = [
+        Stage("sheet", read_sheet),
+        Stage("songs", sync_songs, after=("sheet",), writes=True),
+        Stage("keywords", sync_keywords, after=("sheet",), writes=True),
+        Stage("artists", sync_artists, after=("sheet", "songs"), writes=True),
+        Stage(
+            "keyword_song",
+            sync_keyword_song,
+            after=("sheet", "songs", "keywords"),
+            writes=True,
+        ),
+        Stage(
+            "sheet_state",
+            save_sheet_state,
+            after=("sheet", "songs", "keywords", "artists", "keyword_song"),
+        ),
+        Stage("crawl", crawl),
+        Stage("charts", write, after=("crawl", "songs"), writes=True),
+        Stage("chart_updated", mark_updated, after=("charts",), writes=True),
+    ]
+    if now.hour == 1:
+        stages.append(Stage("lyrics", lyrics, writes=True))
 
-    for row in rows:
-        significant: str = row[columns[config["column"]["significant"]]]
-        significant = significant.strip()
-        if significant == "임시삭제":
-            continue
+    pipeline = Pipeline(stages, serial_writes=backend.serial_writes)
+    pipeline.run()
+    pipeline.report()
 
-        url: str = row[columns[config["column"]["url"]]]
+    for query, executions, total in statement_stats.slowest(5):
+        print(f"{total:8.3f}s {executions:6d}x {query[:100]}")
 
-        if url == "0" or url == "":
-            continue
 
-        full_title: str = row[columns[config["column"]["title"]]]
+def refresh_sheets() -> None:
+    try:
+        sheets.refresh()
+    except Exception as e:
+        print(f"Failed to refresh Google API access token: {e}")
 
-        try:
-            title: str = full_title.split(" - ")[1]
-        except:
-            print(f"Failed to get title from full_title: {full_title}")
-            continue
 
-        artist: str = full_title.split(" - ")[0].replace(" x ", ", ")
-        try:
-            id = url.split("/")[-1]
-        except:
-            print(f"Failed to get song_id from url: {url}")
-            continue
+def add_work_hourly(scheduler) -> None:
+    for j in range(0, 24):
+        h: str = str(j)
+        if j < 10:
+            h = f"0{str(j)}"
+        scheduler.every().day.at(f"{h}:00").do(work)
+    # Keeps token refreshes out of the runs themselves.
+    scheduler.every().hour.at(":55").do(refresh_sheets)
 
-        reaction: str = row[columns[config["column"]["reaction"]]]
-        reaction = reaction.replace("https://youtu.be/", "")
 
-        if reaction == "0":
-            reaction = ""
+def read_artists() -> List[Tuple[Optional[str], str]]:
+    """Return the name and id of every artist, to seed a scratch database.
 
-        date_str: str = row[columns[config["column"]["date"]]].replace(".", "")
-        try:
-            date: int = int(date_str)
-        except:
-            print(f"Failed to get date from id : {id}")
-            continue
-        remix: str = row[columns[config["column"]["remix"]]]
+    They are read from the configured database, or from the artist columns
+    of the config when it has none or cannot be reached.
+    """
+    try:
+        with storage.connection() as conn:
+            with conn.cursor(Cursor) as cursor:
+                cursor.execute("SELECT `name`, `artist_id` FROM `artist`")
+                rows = [(name, artist_id) for name, artist_id in cursor.fetchall()]
+        if rows:
+            return rows
+    except Exception as e:
+        print(f"Failed to read the artists of the configured database: {e}")
+    return [(name, artist_id) for artist_id, name in config["column"]["artists"].items()]
+
+
+def replay(stamps: List[str]) -> None:
+    """Run the whole pipeline on recorded sheet snapshots instead of Google.
+
+    Every stamp (all recorded song sheets by default, ``latest`` for the
+    last one) is run in order, with the views recorded by the run it
+    replays instead of YouTube. The results go to a scratch SQLite database
+    and sheet state, never to the configured ones. Both are recreated on
+    every invocation, seeded with the artists only, so a replay does not
+    depend on the previous ones.
+    """
+    if isinstance(storage, SQLiteBackend) and os.path.abspath(
+        storage.pool.path
+    ) == os.path.abspath(REPLAY_DATABASE_PATH):
+        print(f"Replay needs {REPLAY_DATABASE_PATH} for itself, configure another database.")
+        return
 
-        try:
-            start = int(row[columns[config["column"]["start"]]])
-        except:
-            start = 0
+    if not stamps:
+        stamps = sheets.store.stamps("songs")
+    elif stamps == ["latest"]:
+        stamps = sheets.store.stamps("songs")[-1:]
+    artists = read_artists()
 
-        try:
-            end = (
-                int(row[columns[config["column"]["end"]]])
-                if row[columns[config["column"]["end"]]] != ""
-                else 0
-            )
-        except:
-            end = 0
+    for path in (REPLAY_DATABASE_PATH, REPLAY_SHEET_STATE_PATH):
+        for file in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(file):
+                os.remove(file)
 
-        try:
-            rawOrder: str = row[columns[config["column"]["order"]]]
-            if rawOrder == "" or rawOrder == None:
-                print(f"Failed to get order from id : {id}")
-                continue
-            rawOrder = rawOrder.replace(",", "")
-            floatOrder = float(rawOrder)
-            order = int(floatOrder * 100)
-        except:
-            print(f"Failed to get order from id : {id}")
-            continue
+    scratch = SQLiteBackend(SQLitePool(path=REPLAY_DATABASE_PATH))
+    replay_sheet_state = SheetState(REPLAY_SHEET_STATE_PATH)
+    try:
+        with scratch.connection() as conn:
+            with conn.cursor(Cursor) as cursor:
+                cursor.executemany(
+                    "INSERT INTO `artist` (`name`, `artist_id`) VALUES (%s, %s)", artists
+                )
+            conn.commit()
 
-        raw_keywords: str = row[columns[config["column"]["keyword"]]]
-        if raw_keywords != None and raw_keywords != "":
-            keywords = raw_keywords.split(",")
-        else:
-            keywords = []
-
-        songs[id] = {
-            "song_id": id,
-            "title": title,
-            "artist": artist,
-            "remix": remix,
-            "reaction": reaction,
-            "date": date,
-            "start": start,
-            "end": end,
-            "order": order,
-        }
-
-        for artist_id, name in config["column"]["artists"].items():
-            if artist_id not in artists_songs:
-                artists_songs[artist_id] = []
-
-            is_artist = row[columns[name]]
-            if is_artist == "":
+        # Each hour is measured against the ones before it.
+        for stamp in sorted(stamps):
+            try:
+                replay_views = sheets.store.load("views", stamp)
+            except (OSError, ValueError) as e:
+                print(f"Skipping sheet snapshot {stamp}, no views were recorded: {e}")
                 continue
 
-            artists_songs[artist_id].append(id)
-
-        for keyword in keywords:
-            processed_keyword = keyword.strip().lower()
-            if processed_keyword not in keyword_song:
-                keyword_song[processed_keyword] = []
-
-            keyword_song[processed_keyword].append(id)
-
-    db_songs = update_songs(conn=conn, songs=songs)
-    db_keywords = update_keywords(conn=conn, keywords=list(keyword_song.keys()))
+            print(f"Replaying sheet snapshot {stamp}.")
+            sheets.replay = stamp
+            start = time.perf_counter()
+            try:
+                work(
+                    now=datetime.strptime(stamp, STAMP_FORMAT),
+                    sheet_state=replay_sheet_state,
+                    replay_views=replay_views,
+                    backend=scratch,
+                )
+            finally:
+                sheets.replay = None
+            print(f"Replayed {stamp} in {time.perf_counter() - start:.2f}s.")
+    finally:
+        scratch.close()
 
-    update_artists(
-        conn=conn, songs=db_songs, artists_songs=artists_songs, artists=artists
-    )
-    update_keyword_song(
-        conn=conn, keywords=db_keywords, keyword_song=keyword_song, songs=db_songs
-    )
-    update_charts(conn=conn, songs=db_songs, charts=charts)
 
-    with conn.cursor(Cursor) as cursor:
-        chart_updated_time = int(time.time())
+def rollback(charts: List[str]) -> None:
+    """Put back the charts replaced by the last swap, e.g. after a bad run."""
+    if not storage.swappable:
+        print("Rollback needs chart swaps, which the storage backend does not support.")
+        return
+    unknown = [chart for chart in charts if chart not in CHARTS]
+    if not charts or unknown:
+        print(f"Usage: crawler.py rollback <chart>..., charts being {', '.join(CHARTS)}")
+        return
+    with storage.connection() as conn:
         for chart in charts:
-            cursor.execute(
-                "UPDATE chart_updated SET time = %s WHERE type = %s",
-                (chart_updated_time, chart),
-            )
-    conn.commit()
-    print("Successfully updated wakmusic chart data.")
+            if rollback_chart(conn=conn, chart=chart):
+                print(f"Rolled back chart {chart}.")
 
-    conn.close()
 
+def recompute(at: str, charts: List[str]) -> None:
+    """Rewrite charts for the hour ``at`` (YYYY-MM-DDTHH) from the view history.
 
-def add_work_hourly(scheduler) -> None:
-    for j in range(0, 24):
-        h: str = str(j)
-        if j < 10:
-            h = f"0{str(j)}"
-        scheduler.every().day.at(f"{h}:00").do(work)
+    Defaults to the charts a run at that hour would have written.
+    """
+    if config.get("crawler", {}).get("history") is None:
+        print("Recomputing charts needs crawler.history to be configured.")
+        return
+    try:
+        hour = datetime.strptime(at, "%Y-%m-%dT%H")
+    except ValueError:
+        print(f"Usage: crawler.py recompute YYYY-MM-DDTHH [chart...], not {at}")
+        return
+    charts = charts or get_charts_to_update(time=hour)
+    unknown = [chart for chart in charts if chart not in CHARTS]
+    if unknown:
+        print(f"Unknown charts {', '.join(unknown)}, charts being {', '.join(CHARTS)}")
+        return
+
+    with storage.connection() as conn:
+        written = recompute_charts(conn=conn, backend=storage, charts=charts, at=hour)
+        mark_charts_updated(conn=conn, charts=written)
+    print(f"Recomputed charts {', '.join(written) or 'none'} for {hour}.")
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["replay"]:
+        replay(stamps=sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ["rollback"]:
+        rollback(charts=sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ["recompute"]:
+        if len(sys.argv) > 2:
+            recompute(at=sys.argv[2], charts=sys.argv[3:])
+        else:
+            print("Usage: crawler.py recompute YYYY-MM-DDTHH [chart...]")
+        sys.exit()
+
     add_work_hourly(schedule)
     print("Wakmusic Crawler v2 started.")
 
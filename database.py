@@ -0,0 +1,233 @@
+"""Pooled MySQL connections with per-statement timing, and the storage backends.
+
+Statements are written in the MySQL dialect with pymysql's ``%s``
+placeholders. The few parts that differ between databases are taken from
+the :class:`Backend` the crawler runs on.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, ContextManager, Dict, Iterator, List, Sequence, Set, Tuple
+
+from pymysql import Connection, MySQLError, connect
+from pymysql import cursors
+
+
+class StatementStats:
+    """Execution count and total time per SQL statement, across threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def record(self, query: str, elapsed: float) -> None:
+        with self._lock:
+            stat = self._stats[query]
+            stat[0] += 1
+            stat[1] += elapsed
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def slowest(self, count: int = 10) -> List[Tuple[str, int, float]]:
+        """Return ``(query, executions, total seconds)``, slowest total first."""
+        with self._lock:
+            stats = [(query, int(n), total) for query, (n, total) in self._stats.items()]
+        return sorted(stats, key=lambda stat: stat[2], reverse=True)[:count]
+
+
+statement_stats = StatementStats()
+
+
+class _TimedCursorMixin:
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            statement_stats.record(query, time.perf_counter() - start)
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, args)
+        finally:
+            statement_stats.record(query, time.perf_counter() - start)
+
+
+class Cursor(_TimedCursorMixin, cursors.Cursor):
+    """:class:`pymysql.cursors.Cursor` that records statement timings."""
+
+
+class DictCursor(_TimedCursorMixin, cursors.DictCursor):
+    """:class:`pymysql.cursors.DictCursor` that records statement timings."""
+
+
+class SSCursor(_TimedCursorMixin, cursors.SSCursor):
+    """Unbuffered :class:`pymysql.cursors.SSCursor` that records statement timings.
+
+    Only the time to send the statement and receive the first rows is
+    recorded; rows are streamed while iterating.
+    """
+
+
+class DatabasePool:
+    """Thread-safe pool of long-lived MySQL connections.
+
+    Connections are health checked with a ping when they are handed out and
+    replaced if the server has dropped them, so a pool can be kept across
+    hourly runs.
+    """
+
+    def __init__(self, maxsize: int = 4, **connect_kwargs) -> None:
+        self.maxsize = maxsize
+        self.connect_kwargs = connect_kwargs
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def acquire(self) -> Connection:
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return connect(**self.connect_kwargs)
+            try:
+                # Reconnects in place if the server dropped the connection.
+                conn.ping(reconnect=True)
+                return conn
+            except MySQLError:
+                # A failed reconnect has closed the connection already;
+                # closing again would hide why the server is unreachable.
+                if conn.open:
+                    try:
+                        conn.close()
+                    except MySQLError:
+                        pass
+                raise
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: Connection, reusable: bool = True) -> None:
+        if reusable and conn.open:
+            with self._lock:
+                self._idle.append(conn)
+        elif conn.open:
+            try:
+                conn.close()
+            except MySQLError:
+                pass
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        """Borrow a connection, rolling back anything left uncommitted."""
+        conn = self.acquire()
+        reusable = True
+        try:
+            yield conn
+        finally:
+            try:
+                conn.rollback()
+            except MySQLError:
+                reusable = False
+            self.release(conn, reusable=reusable)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Backend:
+    """Storage a run is written to: a connection pool and what its database supports."""
+
+    # Whether the view history is partitioned by month.
+    partitioned = False
+    # Whether a chart can be loaded aside and swapped in with RENAME TABLE.
+    swappable = False
+    # Whether writing stages must run one at a time, for single-writer databases.
+    serial_writes = False
+    # Whether chart rows can be bulk loaded with LOAD DATA LOCAL INFILE.
+    local_infile = False
+
+    def __init__(self, pool: Any) -> None:
+        self.pool = pool
+
+    def connection(self) -> ContextManager[Connection]:
+        """Borrow a connection of the pool, see :meth:`DatabasePool.connection`."""
+        return self.pool.connection()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def columns(self, cursor: cursors.Cursor, table: str) -> Set[str]:
+        """Return the names of the columns of ``table``."""
+        raise NotImplementedError
+
+    def upsert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        keys: Sequence[str],
+        assignments: Sequence[str] = (),
+    ) -> str:
+        """Return an INSERT of ``columns`` that updates the row on a conflict instead.
+
+        :param str table:
+            Table inserted into.
+        :param columns:
+            Columns inserted, one ``%s`` placeholder each. Those not in
+            ``keys`` are updated on a conflict.
+        :param keys:
+            Columns of the unique key a conflict is detected on.
+        :param assignments:
+            Extra ``column = expression`` updates made on a conflict.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _insert(table: str, columns: Sequence[str]) -> str:
+        return (
+            f"INSERT INTO `{table}` ({', '.join(f'`{column}`' for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+
+
+class MySQLBackend(Backend):
+    """MySQL, through a :class:`DatabasePool`."""
+
+    partitioned = True
+    swappable = True
+
+    def __init__(self, pool: DatabasePool, local_infile: bool = False) -> None:
+        super().__init__(pool)
+        self.local_infile = local_infile
+
+    def columns(self, cursor: cursors.Cursor, table: str) -> Set[str]:
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,),
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def upsert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        keys: Sequence[str],
+        assignments: Sequence[str] = (),
+    ) -> str:
+        updates = [
+            f"`{column}` = VALUES(`{column}`)" for column in columns if column not in keys
+        ]
+        return (
+            f"{self._insert(table, columns)} "
+            f"ON DUPLICATE KEY UPDATE {', '.join([*updates, *assignments])}"
+        )
@@ -0,0 +1,157 @@
+"""Append-only hourly view history, the baseline of every chart increase.
+
+Every run appends one ``(song_id, hour, views)`` row per fetched song, where
+``hour`` counts hours since the epoch. A chart's increase is the difference
+with the latest row at or before the chart's previous boundary, so a missed
+run only widens the span of the next increase instead of losing the
+baseline, and any chart can be recomputed from history after an outage.
+
+Cold songs that were not fetched get a row too, flagged ``interpolated``, so
+their next hourly increase stays one hour long. Recomputing only reads the
+observed rows.
+"""
+import calendar
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+
+from pymysql.cursors import Cursor
+
+from database import Backend
+
+HISTORY_TABLE = "view_history"
+
+CREATE_HISTORY_TABLE = (
+    f"CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} ("
+    "song_id INT NOT NULL, "
+    "hour INT UNSIGNED NOT NULL, "
+    "views BIGINT NOT NULL, "
+    "interpolated TINYINT NOT NULL DEFAULT 0, "
+    "PRIMARY KEY (song_id, hour)"
+    ")"
+)
+# Partitioned by month on hour so baseline lookups only touch the months they
+# need and old months can be dropped as a whole.
+PARTITION_CLAUSE = " PARTITION BY RANGE (hour) (PARTITION p_future VALUES LESS THAN MAXVALUE)"
+
+BASELINE_QUERY = (
+    f"SELECT h.song_id, h.views FROM {HISTORY_TABLE} h JOIN ("
+    f"SELECT song_id, MAX(hour) AS hour FROM {HISTORY_TABLE} "
+    "WHERE hour BETWEEN %s AND %s{condition} GROUP BY song_id"
+    ") latest ON h.song_id = latest.song_id AND h.hour = latest.hour"
+)
+
+
+def to_hour(time: datetime) -> int:
+    """Return the number of whole hours between the epoch and ``time``."""
+    return int(time.timestamp() // 3600)
+
+
+def month_start(year: int, month: int) -> datetime:
+    """Return midnight of the first day of a month, normalising ``month``."""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+def previous_boundary(chart: str, time: datetime) -> datetime:
+    """Return when the period of ``chart`` ending at ``time`` started."""
+    if chart == "daily":
+        return time - timedelta(days=1)
+    if chart == "weekly":
+        return time - timedelta(weeks=1)
+    if chart == "monthly":
+        start = month_start(time.year, time.month - 1)
+        day = min(time.day, calendar.monthrange(start.year, start.month)[1])
+        return time.replace(year=start.year, month=start.month, day=day)
+    return time - timedelta(hours=1)
+
+
+def ensure_history_table(cursor: Cursor, backend: Backend, time: datetime) -> None:
+    """Create the history table and the partitions of this month and the next.
+
+    Backends without partitioning, like SQLite, get a plain table.
+    """
+    cursor.execute(
+        CREATE_HISTORY_TABLE + PARTITION_CLAUSE if backend.partitioned else CREATE_HISTORY_TABLE
+    )
+    # Tables created before interpolated rows were flagged.
+    if "interpolated" not in backend.columns(cursor, HISTORY_TABLE):
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} ADD COLUMN interpolated TINYINT NOT NULL DEFAULT 0"
+        )
+    if not backend.partitioned:
+        return
+
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (HISTORY_TABLE,),
+    )
+    partitions: Set[str] = {row[0] for row in cursor.fetchall()}
+
+    for offset in (0, 1):
+        start = month_start(time.year, time.month + offset)
+        name = f"p{start:%Y%m}"
+        if name in partitions:
+            continue
+        end = to_hour(month_start(start.year, start.month + 1))
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} REORGANIZE PARTITION p_future INTO ("
+            f"PARTITION {name} VALUES LESS THAN ({end}), "
+            "PARTITION p_future VALUES LESS THAN MAXVALUE)"
+        )
+
+
+def append_history(
+    cursor: Cursor,
+    backend: Backend,
+    hour: int,
+    song_views: Iterable[Tuple[int, int]],
+    interpolated: bool = False,
+) -> int:
+    """Record the views of songs at ``hour``. Re-running an hour overwrites it.
+
+    ``interpolated`` flags views estimated instead of fetched.
+    """
+    rows: List[Tuple[int, int, int, int]] = [
+        (song_id, hour, views, int(interpolated)) for song_id, views in song_views
+    ]
+    if rows:
+        cursor.executemany(
+            backend.upsert(
+                HISTORY_TABLE,
+                columns=("song_id", "hour", "views", "interpolated"),
+                keys=("song_id", "hour"),
+            ),
+            rows,
+        )
+    return len(rows)
+
+
+def views_at(cursor: Cursor, hour: int, lookback: int, observed: bool = False) -> Dict[int, int]:
+    """Return the latest recorded views of every song at or before ``hour``.
+
+    Only the ``lookback`` hours before ``hour`` are searched, so songs that
+    have not been recorded for longer are left out. With ``observed``,
+    interpolated views are left out as well.
+    """
+    condition = " AND interpolated = 0" if observed else ""
+    cursor.execute(BASELINE_QUERY.format(condition=condition), (hour - lookback, hour))
+    return dict(cursor.fetchall())
+
+
+def chart_baselines(
+    cursor: Cursor,
+    charts: Iterable[str],
+    time: datetime,
+    lookback: int,
+    observed: bool = False,
+) -> Dict[str, Dict[int, int]]:
+    """Return the views every chart's increase at ``time`` is measured from."""
+    by_hour: Dict[int, Dict[int, int]] = {}
+    baselines: Dict[str, Dict[int, int]] = {}
+    for chart in charts:
+        hour = to_hour(previous_boundary(chart, time))
+        if hour not in by_hour:
+            by_hour[hour] = views_at(cursor, hour, lookback, observed=observed)
+        baselines[chart] = by_hour[hour]
+    return baselines
@@ -0,0 +1,165 @@
+"""Dependency-graph executor for the stages of a run.
+
+Stages are declared with the stages they come after. Each one starts as
+soon as those have finished, on a thread of its own, and is called with
+their results as keyword arguments named after them. A stage that raises
+skips every stage depending on it, while independent stages go on.
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable[..., Any]
+    after: Tuple[str, ...] = ()
+    # Writing stages are run one at a time when the pipeline serializes writes.
+    writes: bool = False
+
+
+class StageTiming(NamedTuple):
+    name: str
+    status: str
+    start: float
+    end: float
+
+    @property
+    def elapsed(self) -> float:
+        return self.end - self.start
+
+
+class Pipeline:
+    """Runs stages in dependency order, overlapping the independent ones."""
+
+    def __init__(self, stages: List[Stage], serial_writes: bool = False) -> None:
+        """Construct a :class:`Pipeline <Pipeline>`.
+
+        :param list stages:
+            Stages of the run, in any order.
+        :param bool serial_writes:
+            Whether stages marked ``writes`` must not overlap each other, for
+            backends with a single writer like SQLite.
+        """
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"duplicate stage {stage.name}")
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for name in stage.after:
+                if name not in self.stages:
+                    raise ValueError(f"stage {stage.name} comes after unknown stage {name}")
+        self.order = self._sort()
+        self.serial_writes = serial_writes
+        self.timings: Dict[str, StageTiming] = {}
+        self._write_lock = threading.Lock()
+
+    def _sort(self) -> List[str]:
+        order: List[str] = []
+        state: Dict[str, bool] = {}
+
+        def visit(name: str) -> None:
+            if state.get(name) is False:
+                raise ValueError(f"stage {name} depends on itself")
+            if name in state:
+                return
+            state[name] = False
+            for dependency in self.stages[name].after:
+                visit(dependency)
+            state[name] = True
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _call(self, stage: Stage, origin: float, kwargs: Dict[str, Any]) -> Any:
+        lock: Optional[threading.Lock] = (
+            self._write_lock if stage.writes and self.serial_writes else None
+        )
+        if lock is not None:
+            lock.acquire()
+        start = time.perf_counter() - origin
+        status = "failed"
+        try:
+            result = stage.func(**kwargs)
+            status = "done"
+            return result
+        finally:
+            if lock is not None:
+                lock.release()
+            self.timings[stage.name] = StageTiming(
+                stage.name, status, start, time.perf_counter() - origin
+            )
+
+    def run(self) -> Dict[str, Any]:
+        """Run every stage and return the results of those that finished."""
+        results: Dict[str, Any] = {}
+        pending = list(self.order)
+        running: Dict[Future, str] = {}
+        failed = set()
+        self.timings = {}
+        origin = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=len(self.stages) or 1) as executor:
+            while pending or running:
+                for name in list(pending):
+                    after = self.stages[name].after
+                    if any(dependency in failed for dependency in after):
+                        pending.remove(name)
+                        failed.add(name)
+                        now = time.perf_counter() - origin
+                        self.timings[name] = StageTiming(name, "skipped", now, now)
+                    elif all(dependency in results for dependency in after):
+                        pending.remove(name)
+                        kwargs = {dependency: results[dependency] for dependency in after}
+                        future = executor.submit(self._call, self.stages[name], origin, kwargs)
+                        running[future] = name
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        failed.add(name)
+                        print(f"Stage {name} failed: {e}")
+                        traceback.print_exc()
+        return results
+
+    def critical_path(self) -> List[str]:
+        """Return the chain of stages that determined when the run finished."""
+        finished = [timing for timing in self.timings.values() if timing.status != "skipped"]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda timing: timing.end).name]
+        while True:
+            before = [
+                self.timings[name]
+                for name in self.stages[path[-1]].after
+                if name in self.timings
+            ]
+            if not before:
+                break
+            path.append(max(before, key=lambda timing: timing.end).name)
+        return path[::-1]
+
+    def report(self) -> None:
+        """Print the timing of every stage and the critical path of the last run."""
+        for name in self.order:
+            timing = self.timings.get(name)
+            if timing is None:
+                continue
+            print(
+                f"{name:>16} {timing.status:>8} "
+                f"{timing.start:8.2f}s -> {timing.end:8.2f}s ({timing.elapsed:.2f}s)"
+            )
+        path = self.critical_path()
+        if path:
+            print(f"Critical path: {' > '.join(path)} ({self.timings[path[-1]].end:.2f}s)")
@@ -0,0 +1,127 @@
+"""In-memory chart ranking from a single snapshot of every chart table."""
+import hashlib
+from array import array
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CHARTS = ("hourly", "daily", "weekly", "monthly", "total")
+
+# Reads every chart table in one round trip.
+SNAPSHOT_QUERY = " UNION ALL ".join(
+    f"SELECT '{chart}', song_id, views, increase, last FROM chart_{chart}" for chart in CHARTS
+)
+
+# song_id, views, increase, last
+ChartRow = Tuple[int, int, int, int]
+
+
+class ChartSnapshot:
+    """Columns of one chart table, stored as compact arrays."""
+
+    __slots__ = ("song_ids", "views", "increases", "lasts")
+
+    def __init__(self) -> None:
+        self.song_ids = array("q")
+        self.views = array("q")
+        self.increases = array("q")
+        self.lasts = array("q")
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    def append(self, song_id: int, views: int, increase: int, last: int) -> None:
+        self.song_ids.append(song_id)
+        self.views.append(views)
+        self.increases.append(increase)
+        self.lasts.append(last)
+
+    def rows(self) -> Iterable[ChartRow]:
+        return zip(self.song_ids, self.views, self.increases, self.lasts)
+
+    def ranks(self, by_views: bool) -> Dict[int, int]:
+        """Rank songs by views or increase, highest first.
+
+        Ties are broken by song id, lowest first.
+        """
+        keys = self.views if by_views else self.increases
+        # Python's sort is stable, also in reverse, so sorting by song id
+        # first settles ties.
+        order = sorted(range(len(self.song_ids)), key=self.song_ids.__getitem__)
+        order.sort(key=keys.__getitem__, reverse=True)
+        return dict(zip(map(self.song_ids.__getitem__, order), range(1, len(order) + 1)))
+
+
+def build_snapshots(
+    rows: Iterable[Tuple[str, int, int, int, int]]
+) -> Dict[str, ChartSnapshot]:
+    """Group ``(chart, song_id, views, increase, last)`` rows by chart."""
+    snapshots = {chart: ChartSnapshot() for chart in CHARTS}
+    for chart, song_id, views, increase, last in rows:
+        snapshots[chart].append(song_id, views, increase, last)
+    return snapshots
+
+
+def rank_charts(
+    snapshots: Dict[str, ChartSnapshot],
+    song_views: Iterable[Tuple[int, int]],
+    charts: Iterable[str],
+    baselines: Optional[Dict[str, Dict[int, int]]] = None,
+) -> Dict[str, List[ChartRow]]:
+    """Compute the new rows of every requested chart.
+
+    :param snapshots:
+        Current content of the chart tables.
+    :param song_views:
+        ``(song_id, views)`` of every song to chart.
+    :param charts:
+        Charts to compute.
+    :param baselines:
+        (Optional) Per chart, ``song_id -> views`` to measure increases
+        from. Songs missing from it fall back to their views in the current
+        chart.
+    :returns:
+        For every chart, the rows to write, holding the song's views, its
+        increase over the baseline views and its rank in the current chart
+        (0 if it is not charted yet).
+    """
+    song_ids = array("q")
+    views = array("q")
+    for song_id, count in song_views:
+        song_ids.append(song_id)
+        views.append(count)
+
+    results: Dict[str, List[ChartRow]] = {}
+    for chart in charts:
+        snapshot = snapshots[chart]
+        ranks = snapshot.ranks(by_views=chart == "total")
+        previous = dict(zip(snapshot.song_ids, snapshot.views))
+        if baselines and chart in baselines:
+            previous.update(baselines[chart])
+        results[chart] = [
+            (song_id, count, count - previous.get(song_id, 0), ranks.get(song_id, 0))
+            for song_id, count in zip(song_ids, views)
+        ]
+    return results
+
+
+def fingerprint(rows: Iterable[ChartRow]) -> str:
+    """Hash the content of a chart, regardless of row order."""
+    content = array("q", chain.from_iterable(sorted(rows)))
+    return hashlib.blake2b(content.tobytes(), digest_size=16).hexdigest()
+
+
+def diff_rows(
+    snapshot: ChartSnapshot, rows: Iterable[ChartRow]
+) -> Tuple[List[ChartRow], List[int]]:
+    """Compare new chart rows with the current chart.
+
+    :returns:
+        The rows that are new or hold different values, and the ids of the
+        songs that are no longer charted.
+    """
+    current = {row[0]: row for row in snapshot.rows()}
+    changed = []
+    for row in rows:
+        if current.pop(row[0], None) != row:
+            changed.append(row)
+    return changed, list(current)
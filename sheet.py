@@ -0,0 +1,256 @@
+"""Incremental parsing of the song spreadsheet.
+
+Parsed rows are cached in memory under the hash of their cells, across the
+runs of the process, so a run only parses the rows that were added or
+edited since the last one. A fingerprint of the whole sheet, kept on disk,
+tells when nothing changed at all, also right after a restart.
+"""
+import hashlib
+import json
+import os
+from itertools import compress
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypedDict,
+)
+
+STATE_VERSION = 3
+
+
+class SongData(TypedDict):
+    song_id: str
+    title: str
+    artist: str
+    remix: Optional[str]
+    reaction: Optional[str]
+    date: int
+    start: int
+    end: int
+    order: int
+
+
+# A song parsed from a row, the bitset of its artists and its raw keywords.
+ParsedRow = Tuple[SongData, int, List[str]]
+
+
+class Ingest(NamedTuple):
+    songs: Dict[str, SongData]
+    artists_songs: Dict[str, List[str]]
+    keyword_song: Dict[str, List[str]]
+    fingerprint: str
+    parsed: int
+
+
+def get_sheet_index(nameRow: List[str]) -> Dict[str, int]:
+    data: Dict[str, int] = {}
+    for idx, value in enumerate(nameRow):
+        data[value] = idx
+    return data
+
+
+def hash_cells(cells: List[str]) -> str:
+    # Cells are plain strings, so a separator they never hold is enough.
+    content = "\x1f".join(cells)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def to_reaction(value: str) -> str:
+    reaction = value.replace("https://youtu.be/", "")
+    return "" if reaction == "0" else reaction
+
+
+def to_date(value: str) -> int:
+    return int(value.replace(".", ""))
+
+
+def to_offset(value: str) -> int:
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def to_order(value: str) -> int:
+    if value == "":
+        raise ValueError("empty order")
+    return int(float(value.replace(",", "")) * 100)
+
+
+# Song fields read straight from a column, in SongData order. A converter
+# raising ValueError makes the row skipped.
+CONVERTED_FIELDS: Tuple[Tuple[str, Callable[[str], Any]], ...] = (
+    ("remix", str),
+    ("reaction", to_reaction),
+    ("date", to_date),
+    ("start", to_offset),
+    ("end", to_offset),
+    ("order", to_order),
+)
+
+
+def cells_getter(indices: List[int]) -> Callable[[List[str]], Tuple[str, ...]]:
+    """Return a function picking the cells at ``indices`` out of a row, as a tuple."""
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda row: (row[index],)
+    if not indices:
+        return lambda row: ()
+    return itemgetter(*indices)
+
+
+class RowSchema:
+    """Column positions and converters of the song sheet, resolved once from its header.
+
+    Artists are numbered by their position in the ``artists`` column config,
+    and the artists of a row are returned as a bitset of those numbers.
+    """
+
+    __slots__ = ("cells", "names", "converters", "artists", "artist_cells", "artist_bits")
+
+    def __init__(self, header: List[str], column: Dict[str, Any]) -> None:
+        columns = get_sheet_index(nameRow=header)
+        names = ("significant", "url", "title", "keyword")
+        self.cells = cells_getter(
+            [columns[column[name]] for name in names]
+            + [columns[column[name]] for name, _ in CONVERTED_FIELDS]
+        )
+        self.names = tuple(name for name, _ in CONVERTED_FIELDS)
+        self.converters = tuple(converter for _, converter in CONVERTED_FIELDS)
+        self.artists: Tuple[str, ...] = tuple(column["artists"])
+        self.artist_cells = cells_getter(
+            [columns[name] for name in column["artists"].values()]
+        )
+        self.artist_bits = tuple(1 << bit for bit in range(len(self.artists)))
+
+    def parse(self, row: List[str]) -> Optional[ParsedRow]:
+        """Parse one sheet row, or return None if it does not describe a song."""
+        significant, url, full_title, raw_keywords, *cells = self.cells(row)
+        if significant.strip() == "임시삭제":
+            return None
+
+        if url == "0" or url == "":
+            return None
+
+        parts = full_title.split(" - ")
+        if len(parts) < 2:
+            print(f"Failed to get title from full_title: {full_title}")
+            return None
+
+        id = url.split("/")[-1]
+        song = {"song_id": id, "title": parts[1], "artist": parts[0].replace(" x ", ", ")}
+        try:
+            for name, converter, cell in zip(self.names, self.converters, cells):
+                song[name] = converter(cell)
+        except ValueError:
+            print(f"Failed to get {name} from id : {id}")
+            return None
+
+        keywords = raw_keywords.split(",") if raw_keywords else []
+        # Bits are distinct, so their sum is the bitset of non-empty cells.
+        artist_mask = sum(compress(self.artist_bits, self.artist_cells(row)))
+        return song, artist_mask, keywords
+
+    def artist_ids(self, artist_mask: int) -> Iterator[str]:
+        """Return the artist ids set in a bitset returned by :meth:`parse`."""
+        while artist_mask:
+            bit = artist_mask & -artist_mask
+            yield self.artists[bit.bit_length() - 1]
+            artist_mask ^= bit
+
+
+class SheetState:
+    """Fingerprint of the last synced sheet, and the rows parsed from the last read.
+
+    Only the fingerprint is saved. Caching the parsed rows on disk cost more
+    to load and save than parsing them again, so they are only reused within
+    the process.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.header = ""
+        self.fingerprint = ""
+        self.rows: Dict[str, Optional[ParsedRow]] = {}
+
+    def load(self) -> "SheetState":
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return self
+        if state.get("version") != STATE_VERSION:
+            return self
+
+        self.fingerprint = state["fingerprint"]
+        return self
+
+    def save(self) -> None:
+        state = {"version": STATE_VERSION, "fingerprint": self.fingerprint}
+        # Written aside and renamed, so a crash never leaves half a file.
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(state, file, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def ingest_sheet(
+    values: List[List[str]], column: Dict[str, Any], state: SheetState
+) -> Optional[Ingest]:
+    """Parse the sheet, reusing the rows of ``state`` whose cells did not change.
+
+    Returns None without parsing anything if the sheet's fingerprint is the
+    one of ``state``. Otherwise ``state`` is updated in place with the rows
+    of this sheet; it is up to the caller to set its fingerprint and save it
+    once the result is synced.
+    """
+    header = hash_cells([*values[0], json.dumps(column, ensure_ascii=False)])
+    row_hashes = [hash_cells(row) for row in values[1:]]
+    fingerprint = hashlib.blake2b(header.encode("utf-8"), digest_size=16)
+    for row_hash in row_hashes:
+        fingerprint.update(row_hash.encode("utf-8"))
+    if fingerprint.hexdigest() == state.fingerprint:
+        return None
+
+    if header != state.header:
+        state.header, state.rows = header, {}
+    schema = RowSchema(header=values[0], column=column)
+    rows: Dict[str, Optional[ParsedRow]] = {}
+    parsed = 0
+    songs: Dict[str, SongData] = {}
+    artists_songs: Dict[str, List[str]] = {artist_id: [] for artist_id in column["artists"]}
+    keyword_song: Dict[str, List[str]] = {}
+
+    for row_hash, row in zip(row_hashes, values[1:]):
+        if row_hash in rows:
+            result = rows[row_hash]
+        elif row_hash in state.rows:
+            result = rows[row_hash] = state.rows[row_hash]
+        else:
+            result = rows[row_hash] = schema.parse(row)
+            parsed += 1
+        if result is None:
+            continue
+
+        song, artist_mask, keywords = result
+        id = song["song_id"]
+        songs[id] = song
+        for artist_id in schema.artist_ids(artist_mask):
+            artists_songs[artist_id].append(id)
+        for keyword in keywords:
+            processed_keyword = keyword.strip().lower()
+            if processed_keyword not in keyword_song:
+                keyword_song[processed_keyword] = []
+
+            keyword_song[processed_keyword].append(id)
+
+    state.rows = rows
+    return Ingest(songs, artists_songs, keyword_song, fingerprint.hexdigest(), parsed)
@@ -0,0 +1,171 @@
+"""Long-lived Google Sheets client shared by every hourly run.
+
+The credentials, the authorized client and the worksheet handles are kept
+between runs, so a run does not pay for authorizing and opening the
+spreadsheets again. Every request has a timeout, and reads are retried a
+bounded number of times, then fall back to the last good result of the
+same read.
+
+With a :class:`SnapshotStore <snapshot.SnapshotStore>`, every successful
+read is also saved locally. The saved snapshots are the fallback once the
+process restarted, and can be replayed instead of reading Google at all.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import gspread
+from gspread import Worksheet
+from oauth2client.service_account import ServiceAccountCredentials
+
+from snapshot import SnapshotStore
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+T = TypeVar("T")
+
+
+class SheetUnavailable(Exception):
+    """A sheet could not be read and there is no previous result to fall back to."""
+
+    def __init__(self, name: str):
+        super().__init__(f"sheet {name} is unavailable")
+        self.name = name
+
+
+class SheetClient:
+    """Cached, retrying access to Google spreadsheets."""
+
+    def __init__(
+        self,
+        keyfile: str,
+        attempts: int = 3,
+        delay: float = 2.0,
+        timeout: float = 60.0,
+        refresh_margin: timedelta = timedelta(minutes=15),
+        store: Optional[SnapshotStore] = None,
+    ):
+        """Construct a :class:`SheetClient <SheetClient>`.
+
+        :param str keyfile:
+            Service account key file.
+        :param int attempts:
+            Maximum number of attempts per read.
+        :param float delay:
+            Seconds to wait before the first retry, doubled on every retry.
+        :param float timeout:
+            Seconds to wait for each request to Google. A request timing out
+            counts as a failed attempt.
+        :param timedelta refresh_margin:
+            How long before its expiry :meth:`refresh` renews the access token.
+        :param SnapshotStore store:
+            (Optional) Where successful reads are saved and fallen back to.
+        """
+        self.keyfile = keyfile
+        self.attempts = attempts
+        self.delay = delay
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.store = store
+        # Stamp of the snapshots to read instead of Google, see replay.
+        self.replay: Optional[str] = None
+        self._client: Optional[gspread.Client] = None
+        self._worksheets: Dict[Tuple[str, int], Worksheet] = {}
+        self._last_good: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get_client(self) -> gspread.Client:
+        with self._lock:
+            if self._client is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(
+                    filename=self.keyfile, scopes=SCOPES
+                )
+                self._client = gspread.authorize(creds)
+                self._client.set_timeout(self.timeout)
+            return self._client
+
+    def _get_worksheet(self, url: str, index: int) -> Worksheet:
+        with self._lock:
+            worksheet = self._worksheets.get((url, index))
+        if worksheet is None:
+            worksheet = self._get_client().open_by_url(url).get_worksheet(index)
+            with self._lock:
+                self._worksheets[(url, index)] = worksheet
+        return worksheet
+
+    def _forget(self, url: str, index: int, client: bool) -> None:
+        with self._lock:
+            self._worksheets.pop((url, index), None)
+            if client:
+                self._client = None
+                self._worksheets.clear()
+
+    def fetch(self, name: str, url: str, index: int, read: Callable[[Worksheet], T]) -> T:
+        """Read a worksheet, falling back to the last good result of ``name``.
+
+        :param str name:
+            Name of the read, under which its last good result is kept.
+        :param str url:
+            Spreadsheet URL.
+        :param int index:
+            Worksheet index in the spreadsheet.
+        :param read:
+            Function reading the data out of the worksheet.
+        :raises SheetUnavailable:
+            If every attempt failed and ``name`` was never read before.
+        """
+        if self.replay is not None:
+            return self._load_snapshot(name, stamp=self.replay)
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                result = read(self._get_worksheet(url, index))
+            except Exception as e:
+                print(f"Failed to read sheet {name} ({attempt}/{self.attempts}): {e}")
+                # A stale handle is the usual suspect, then the whole session.
+                self._forget(url, index, client=attempt > 1)
+                if attempt < self.attempts:
+                    time.sleep(self.delay * 2 ** (attempt - 1))
+            else:
+                with self._lock:
+                    self._last_good[name] = result
+                self._save_snapshot(name, result)
+                return result
+
+        with self._lock:
+            if name in self._last_good:
+                print(f"Using the last good read of sheet {name}.")
+                return self._last_good[name]
+        print(f"Using the latest snapshot of sheet {name}.")
+        return self._load_snapshot(name)
+
+    def _save_snapshot(self, name: str, data: Any) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.save(name, data)
+        except (OSError, TypeError) as e:
+            print(f"Failed to save a snapshot of sheet {name}: {e}")
+
+    def _load_snapshot(self, name: str, stamp: Optional[str] = None) -> Any:
+        if self.store is None:
+            raise SheetUnavailable(name)
+        try:
+            return self.store.load(name, stamp=stamp)
+        except (OSError, ValueError) as e:
+            print(e)
+            raise SheetUnavailable(name) from e
+
+    def refresh(self) -> None:
+        """Renew the access token if it expires within the refresh margin.
+
+        Meant to run shortly before the hourly run, so that run does not
+        wait for the token.
+        """
+        client = self._get_client()
+        # google-auth keeps expiry as a naive UTC datetime.
+        expiry = getattr(client.auth, "expiry", None)
+        if expiry is None or expiry - datetime.utcnow() < self.refresh_margin:
+            client.login()
+            print("Refreshed Google API access token.")
@@ -0,0 +1,73 @@
+"""Local store of fetched sheet data and views, for fallback and replay.
+
+Every read of a sheet, and the views fetched by a run, can be saved as a gzip-compressed, versioned JSON file
+named after the time it was fetched and the read's name, for example
+``202611010100-songs.json.gz``.
+"""
+import glob
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Any, List, Optional
+
+SNAPSHOT_VERSION = 1
+STAMP_FORMAT = "%Y%m%d%H%M"
+
+
+class SnapshotStore:
+    """Directory of snapshots, pruned to the most recent ones per name."""
+
+    def __init__(self, path: str, keep: int = 168):
+        """Construct a :class:`SnapshotStore <SnapshotStore>`.
+
+        :param str path:
+            Directory holding the snapshots. Created when missing.
+        :param int keep:
+            Number of snapshots kept per name.
+        """
+        self.path = path
+        self.keep = keep
+
+    def _file(self, stamp: str, name: str) -> str:
+        return os.path.join(self.path, f"{stamp}-{name}.json.gz")
+
+    def stamps(self, name: str) -> List[str]:
+        """Return the stamps of the snapshots of ``name``, oldest first."""
+        suffix = f"-{name}.json.gz"
+        files = glob.glob(os.path.join(glob.escape(self.path), f"*{suffix}"))
+        return sorted(os.path.basename(file)[: -len(suffix)] for file in files)
+
+    def save(self, name: str, data: Any, time: Optional[datetime] = None) -> str:
+        """Save ``data`` as the snapshot of ``name`` at ``time`` and return its stamp."""
+        os.makedirs(self.path, exist_ok=True)
+        stamp = (time or datetime.now()).strftime(STAMP_FORMAT)
+        content = {"version": SNAPSHOT_VERSION, "name": name, "stamp": stamp, "data": data}
+
+        file = self._file(stamp, name)
+        # Written aside and renamed, so a crash never leaves half a file.
+        with gzip.open(file + ".tmp", "wt", encoding="utf-8") as output:
+            json.dump(content, output, ensure_ascii=False, separators=(",", ":"))
+        os.replace(file + ".tmp", file)
+
+        for old in self.stamps(name)[: -self.keep]:
+            os.remove(self._file(old, name))
+        return stamp
+
+    def load(self, name: str, stamp: Optional[str] = None) -> Any:
+        """Return the latest snapshot of ``name`` taken at or before ``stamp``.
+
+        :raises FileNotFoundError:
+            If there is no such snapshot.
+        """
+        stamps = [
+            candidate for candidate in self.stamps(name) if stamp is None or candidate <= stamp
+        ]
+        if not stamps:
+            raise FileNotFoundError(f"no snapshot of {name} at or before {stamp or 'now'}")
+
+        with gzip.open(self._file(stamps[-1], name), "rt", encoding="utf-8") as file:
+            content = json.load(file)
+        if content.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {content.get('version')}")
+        return content["data"]
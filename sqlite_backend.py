@@ -0,0 +1,322 @@
+"""SQLite storage backend, with a drop-in for :class:`database.DatabasePool`.
+
+Connections mimic the small part of the pymysql API the crawler uses,
+including its parameters: ``%s`` placeholders and ``IN %s`` with a list or
+a list of pairs. Statements whose syntax differs, like upserts, are built by
+:class:`SQLiteBackend`.
+
+The database runs in WAL mode, so readers keep seeing the last committed run
+while a new one is written. Each borrowed connection is one transaction:
+``commit()`` and ``rollback()`` only close or undo the current step, through
+a savepoint, and everything is committed at once when the connection is
+given back.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional, Sequence, Set, Tuple
+
+from pymysql import cursors
+
+from database import Backend, statement_stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS song (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    remix TEXT,
+    reaction TEXT,
+    date INTEGER NOT NULL,
+    start INTEGER NOT NULL DEFAULT 0,
+    end INTEGER NOT NULL DEFAULT 0,
+    `order` INTEGER,
+    deleted_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS artist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    artist_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS artist_song (
+    artist_id INTEGER NOT NULL,
+    song_id INTEGER NOT NULL,
+    PRIMARY KEY (artist_id, song_id)
+);
+CREATE TABLE IF NOT EXISTS keyword (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    keyword TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS keyword_song (
+    keyword_id INTEGER NOT NULL,
+    song_id INTEGER NOT NULL,
+    PRIMARY KEY (keyword_id, song_id)
+);
+CREATE TABLE IF NOT EXISTS team (
+    team TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS team_pc (
+    team TEXT,
+    member TEXT,
+    type TEXT,
+    role TEXT,
+    `order` INTEGER
+);
+CREATE TABLE IF NOT EXISTS chart_updated (
+    type TEXT PRIMARY KEY,
+    time INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO chart_updated (type) VALUES
+    ('hourly'), ('daily'), ('weekly'), ('monthly'), ('total');
+""" + "".join(
+    f"""
+CREATE TABLE IF NOT EXISTS chart_{chart} (
+    song_id INTEGER PRIMARY KEY,
+    views INTEGER NOT NULL,
+    increase INTEGER NOT NULL,
+    last INTEGER NOT NULL
+);"""
+    for chart in ("hourly", "daily", "weekly", "monthly", "total")
+)
+
+
+@lru_cache(maxsize=256)
+def translate(query: str, shape: Tuple[int, ...] = ()) -> str:
+    """Rewrite the ``%s`` placeholders of a pymysql statement for SQLite.
+
+    :param str query:
+        Statement using ``%s`` placeholders.
+    :param shape:
+        Per placeholder, ``0`` for a scalar, ``n`` for a list of ``n``
+        scalars, or ``-n`` for a list of ``n`` pairs.
+    """
+    parts = query.split("%s")
+    shape = shape or (0,) * (len(parts) - 1)
+    sql = parts[0]
+    for size, part in zip(shape, parts[1:]):
+        if size > 0:
+            sql += "(" + ", ".join("?" * size) + ")"
+        elif size < 0:
+            sql += "(VALUES " + ", ".join(["(?, ?)"] * -size) + ")"
+        else:
+            sql += "?"
+        sql += part
+    return sql
+
+
+def flatten(args: Optional[Sequence[Any]]) -> Tuple[Tuple[int, ...], List[Any]]:
+    """Return the shape of ``args`` for :func:`translate` and the flat values."""
+    if args is None:
+        return (), []
+    shape: List[int] = []
+    values: List[Any] = []
+    for arg in args:
+        if not isinstance(arg, (list, tuple)):
+            shape.append(0)
+            values.append(arg)
+        elif arg and isinstance(arg[0], (list, tuple)):
+            shape.append(-len(arg))
+            for pair in arg:
+                values.extend(pair)
+        else:
+            shape.append(len(arg))
+            values.extend(arg)
+    return tuple(shape), values
+
+
+class SQLiteCursor:
+    """pymysql-style cursor over a :class:`sqlite3.Cursor`."""
+
+    def __init__(self, cursor: sqlite3.Cursor, as_dict: bool = False) -> None:
+        self._cursor = cursor
+        self._as_dict = as_dict
+
+    def __enter__(self) -> "SQLiteCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.fetchone, None)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def _row(self, row: Optional[tuple]) -> Any:
+        if row is None or not self._as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def execute(self, query: str, args: Optional[Sequence[Any]] = None) -> int:
+        start = time.perf_counter()
+        try:
+            shape, values = flatten(args)
+            self._cursor.execute(translate(query, shape), values)
+            return self._cursor.rowcount
+        finally:
+            statement_stats.record(query, time.perf_counter() - start)
+
+    def executemany(self, query: str, args: Sequence[Sequence[Any]]) -> int:
+        start = time.perf_counter()
+        try:
+            # pymysql takes bare values for single-placeholder statements.
+            rows = (arg if isinstance(arg, (list, tuple)) else (arg,) for arg in args)
+            self._cursor.executemany(translate(query), rows)
+            return self._cursor.rowcount
+        finally:
+            statement_stats.record(query, time.perf_counter() - start)
+
+    def fetchone(self) -> Any:
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self) -> List[Any]:
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """pymysql-style connection whose commits are savepoints of one transaction."""
+
+    def __init__(self, path: str, timeout: float) -> None:
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self.open = True
+
+    def cursor(self, cursor: type = cursors.Cursor) -> SQLiteCursor:
+        return SQLiteCursor(
+            self._conn.cursor(), as_dict=issubclass(cursor, cursors.DictCursor)
+        )
+
+    def begin(self) -> None:
+        self._conn.execute("BEGIN")
+        self._conn.execute("SAVEPOINT step")
+
+    def commit(self) -> None:
+        self._conn.execute("RELEASE step")
+        self._conn.execute("SAVEPOINT step")
+
+    def rollback(self) -> None:
+        self._conn.execute("ROLLBACK TO step")
+
+    def finish(self) -> None:
+        """Drop the uncommitted step and commit every committed one."""
+        self.rollback()
+        self._conn.execute("RELEASE step")
+        self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        if self.open:
+            self._conn.close()
+            self.open = False
+
+
+class SQLitePool:
+    """Pool of :class:`SQLiteConnection`, with the API of :class:`database.DatabasePool`."""
+
+    def __init__(self, path: str, maxsize: int = 4, timeout: float = 3600) -> None:
+        """Construct a :class:`SQLitePool <SQLitePool>`, creating the schema.
+
+        :param str path:
+            Database file.
+        :param int maxsize:
+            Maximum number of connections handed out at once.
+        :param float timeout:
+            Seconds to wait for the write lock, held for a whole run by
+            whichever connection writes first.
+        """
+        self.path = path
+        self.timeout = timeout
+        self._idle: List[SQLiteConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+        conn = SQLiteConnection(path, timeout)
+        conn._conn.executescript(SCHEMA)
+        self._idle.append(conn)
+
+    def acquire(self) -> SQLiteConnection:
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = SQLiteConnection(self.path, self.timeout)
+            conn.begin()
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: SQLiteConnection, reusable: bool = True) -> None:
+        if reusable and conn.open:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[SQLiteConnection]:
+        """Borrow a connection as one transaction, committed when given back."""
+        conn = self.acquire()
+        reusable = True
+        try:
+            yield conn
+        finally:
+            try:
+                conn.finish()
+            except sqlite3.Error:
+                reusable = False
+            self.release(conn, reusable=reusable)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+
+class SQLiteBackend(Backend):
+    """SQLite, through a :class:`SQLitePool`.
+
+    Readers see the previous charts until a run's transaction commits, so
+    charts need no swap, and writes are serialized on the database's single
+    writer.
+    """
+
+    serial_writes = True
+
+    def __init__(self, pool: SQLitePool) -> None:
+        super().__init__(pool)
+
+    def columns(self, cursor: SQLiteCursor, table: str) -> Set[str]:
+        cursor.execute(f"PRAGMA table_info(`{table}`)")
+        return {row[1] for row in cursor.fetchall()}
+
+    def upsert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        keys: Sequence[str],
+        assignments: Sequence[str] = (),
+    ) -> str:
+        updates = [
+            f"`{column}` = excluded.`{column}`" for column in columns if column not in keys
+        ]
+        return (
+            f"{self._insert(table, columns)} "
+            f"ON CONFLICT ({', '.join(f'`{key}`' for key in keys)}) "
+            f"DO UPDATE SET {', '.join([*updates, *assignments])}"
+        )
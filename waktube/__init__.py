@@ -17,3 +17,4 @@ from waktube.__main__ import YouTube
 from waktube.contrib.playlist import Playlist
 from waktube.contrib.channel import Channel
 from waktube.contrib.search import Search
+from waktube.views import fetch_view_count, fetch_view_counts
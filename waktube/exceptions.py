@@ -15,6 +15,28 @@ class MaxRetriesExceeded(PytubeError):
     """Maximum number of retries exceeded."""
 
 
+class PlayerResponseError(PytubeError):
+    """Player response lacks the requested data for a reason that may pass.
+
+    YouTube answers bot checks and throttled requests with a player response
+    that has no video details, so asking again later can succeed.
+    """
+
+    def __init__(self, video_id: str, status: str, reason: str):
+        """
+        :param str video_id:
+            A YouTube video identifier.
+        :param str status:
+            Playability status of the response.
+        :param str reason:
+            Explanation of the status.
+        """
+        super().__init__(f"{video_id}: player response without details ({status}: {reason})")
+        self.video_id = video_id
+        self.status = status
+        self.reason = reason
+
+
 class HTMLParseError(PytubeError):
     """HTML could not be parsed"""
 
@@ -0,0 +1,286 @@
+"""Hedged requests to cut the latency tail of innertube calls.
+
+When a request is slower than most recent requests, a duplicate is sent and
+whichever answers first is used. The slower one is cancelled, and I/O it
+registered with :func:`track` is aborted so it gives its connection back.
+
+Requests run on the caller's thread; only duplicates run on threads of their
+own, started by a single timer thread.
+"""
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_local = threading.local()
+
+
+def _untracked() -> None:
+    pass
+
+
+class Attempt:
+    """One run of a hedged call, whose I/O is aborted once another run won."""
+
+    def __init__(self):
+        self.lost = False
+        self._closers: Dict[int, Callable[[], None]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def track(self, closer: Callable[[], None]) -> Callable[[], None]:
+        """Register ``closer`` and return the function unregistering it."""
+        with self._lock:
+            if not self.lost:
+                token, self._next = self._next, self._next + 1
+                self._closers[token] = closer
+                return partial(self._untrack, token)
+        closer()
+        return _untracked
+
+    def _untrack(self, token: int) -> None:
+        with self._lock:
+            self._closers.pop(token, None)
+
+    def abandon(self) -> None:
+        """Mark the attempt lost and run every registered closer."""
+        with self._lock:
+            self.lost = True
+            closers, self._closers = list(self._closers.values()), {}
+            # Run under the lock so I/O finishing now cannot untrack mid-way.
+            for closer in closers:
+                try:
+                    closer()
+                except OSError:
+                    pass
+
+
+def track(closer: Callable[[], None]) -> Callable[[], None]:
+    """Register ``closer`` to abort I/O if the hedged attempt running it loses.
+
+    Outside of a hedged call nothing is registered.
+
+    :param closer:
+        Function aborting the I/O, e.g. shutting its socket down.
+    :returns:
+        Function to call once the I/O is over, unregistering ``closer``.
+    """
+    attempt: Optional[Attempt] = getattr(_local, "attempt", None)
+    if attempt is None:
+        return _untracked
+    return attempt.track(closer)
+
+
+class Timer:
+    """Runs callbacks at given times, all on one daemon thread started on demand."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_at(self, when: float, callback: Callable[[], None]) -> None:
+        """Run ``callback`` once :func:`time.monotonic` reaches ``when``.
+
+        Callbacks must be quick, since they run one after the other.
+        """
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._order), callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(
+                        self._heap[0][0] - time.monotonic() if self._heap else None
+                    )
+                _, _, callback = heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception:  # noqa: B902
+                logger.exception("timer callback failed")
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Return the nearest-rank percentile of already sorted values.
+
+    :param list sorted_values:
+        Values sorted in ascending order. Must not be empty.
+    :param float percent:
+        Percentile between 0 and 100.
+    """
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Hedger:
+    """Send one duplicate request when the first one is slower than usual."""
+
+    def __init__(
+        self,
+        percent: float = 95,
+        max_ratio: float = 0.05,
+        window: int = 1000,
+        min_samples: int = 20,
+        max_workers: int = 64,
+    ):
+        """Construct a :class:`Hedger <Hedger>`.
+
+        :param float percent:
+            Latency percentile of recent requests after which a hedge is sent.
+        :param float max_ratio:
+            Maximum share of requests that may be hedged.
+        :param int window:
+            Number of recent latencies the percentile is computed from.
+        :param int min_samples:
+            Number of latencies to observe before hedging at all.
+        :param int max_workers:
+            Number of threads running hedges. Requests themselves run on the
+            caller's thread.
+        """
+        self.percent = percent
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.skipped = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="waktube-hedge"
+        )
+        self._timer = Timer(name="waktube-hedge-timer")
+
+    def _threshold(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return percentile(sorted(self._latencies), self.percent)
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _timed(self, attempt: Attempt, func: Callable[..., T], *args, **kwargs) -> T:
+        previous = getattr(_local, "attempt", None)
+        _local.attempt = attempt
+        try:
+            start = time.monotonic()
+            result = func(*args, **kwargs)
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+            return result
+        finally:
+            _local.attempt = previous
+
+    def call(
+        self,
+        func: Callable[..., T],
+        *args,
+        can_hedge: Optional[Callable[[], bool]] = None,
+        **kwargs,
+    ) -> T:
+        """Call ``func``, hedging it if it is slower than the threshold.
+
+        ``func`` runs on the calling thread. The first successful result wins
+        and the other attempt is abandoned, which makes a losing ``func``
+        fail fast if its I/O was tracked. An error is only raised once every
+        attempt has failed.
+
+        :param can_hedge:
+            (Optional) Returns whether a hedge could start right away, e.g.
+            whether a connection is free. No hedge is sent otherwise, since
+            it would only queue behind the request it duplicates.
+        """
+        with self._lock:
+            self.requests += 1
+        threshold = self._threshold()
+        primary = Attempt()
+        if threshold is None:
+            return self._timed(primary, func, *args, **kwargs)
+
+        lock = threading.Lock()
+        finished = False
+        winner: Optional[Attempt] = None
+        hedge = Attempt()
+        hedges: List[Future] = []
+
+        def on_hedge_done(future: Future) -> None:
+            nonlocal winner
+            if future.cancelled() or future.exception() is not None:
+                return
+            with lock:
+                if winner is not None:
+                    return
+                winner = hedge
+            primary.abandon()
+
+        def start_hedge() -> None:
+            with lock:
+                if finished:
+                    return
+                if can_hedge is not None and not can_hedge():
+                    with self._lock:
+                        self.skipped += 1
+                    return
+                if not self._take_hedge():
+                    return
+                logger.debug("request slower than %.3fs, hedging", threshold)
+                hedges.append(self._executor.submit(self._timed, hedge, func, *args, **kwargs))
+            hedges[0].add_done_callback(on_hedge_done)
+
+        self._timer.call_at(time.monotonic() + threshold, start_hedge)
+        error: Optional[BaseException] = None
+        try:
+            result = self._timed(primary, func, *args, **kwargs)
+        except Exception as e:  # noqa: B902
+            error = e
+
+        with lock:
+            finished = True
+            if error is None and winner is None:
+                winner = primary
+        if winner is primary:
+            if hedges:
+                hedges[0].cancel()
+                hedge.abandon()
+            return result
+        if not hedges:
+            raise error
+        # The hedge won, or is the only attempt left.
+        return hedges[0].result()
+
+    def stats(self) -> Dict[str, float]:
+        """Return the hedge rate, the skipped hedges and the p50/p95/p99 latencies."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            requests, hedges, skipped = self.requests, self.hedges, self.skipped
+
+        stats = {
+            "requests": requests,
+            "hedges": hedges,
+            "skipped": skipped,
+            "hedge_rate": hedges / requests if requests else 0.0,
+        }
+        for percent in (50, 95, 99):
+            stats[f"p{percent}"] = percentile(latencies, percent) if latencies else 0.0
+        return stats
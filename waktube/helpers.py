@@ -255,10 +255,20 @@ def target_directory(output_path: Optional[str] = None) -> str:
     return output_path
 
 
+_installed_proxies: Dict[str, str] = {}
+
+
 def install_proxy(proxy_handler: Dict[str, str]) -> None:
     proxy_support = request.ProxyHandler(proxy_handler)
     opener = request.build_opener(proxy_support)
     request.install_opener(opener)
+    _installed_proxies.clear()
+    _installed_proxies.update(proxy_handler)
+
+
+def installed_proxies() -> Dict[str, str]:
+    """Return the proxies installed with :func:`install_proxy`, by scheme."""
+    return dict(_installed_proxies)
 
 
 def uniqueify(duped_list: List) -> List:
@@ -13,6 +13,7 @@ from urllib import parse
 
 # Local imports
 from waktube import request
+from waktube.pool import default_pool
 
 # YouTube on TV client secrets
 _client_id = "861556708454-d6dlm3lh05idd8npek18k6be8ba3oc68.apps.googleusercontent.com"
@@ -61,6 +62,9 @@ _default_clients = {
     },
 }
 _token_timeout = 1800
+# Seconds a request may stall before it fails, so a hung connection cannot
+# hold its worker forever.
+_request_timeout = 10
 _cache_dir = pathlib.Path(__file__).parent.resolve() / "__cache__"
 _token_file = os.path.join(_cache_dir, "tokens.json")
 
@@ -68,7 +72,14 @@ _token_file = os.path.join(_cache_dir, "tokens.json")
 class InnerTube:
     """Object for interacting with the innertube API."""
 
-    def __init__(self, client="WEB", use_oauth=False, allow_cache=True):
+    def __init__(
+        self,
+        client="WEB",
+        use_oauth=False,
+        allow_cache=True,
+        hedger=None,
+        timeout=_request_timeout,
+    ):
         """Initialize an InnerTube object.
 
         :param str client:
@@ -78,6 +89,10 @@ class InnerTube:
             Whether or not to authenticate to YouTube.
         :param bool allow_cache:
             Allows caching of oauth tokens on the machine.
+        :param Hedger hedger:
+            (Optional) Hedges slow API calls when given.
+        :param float timeout:
+            Seconds a request may stall on connecting or reading.
         """
         self.context = _default_clients[client]["context"]
         self.api_key = _default_clients[client]["api_key"]
@@ -85,6 +100,8 @@ class InnerTube:
         self.refresh_token = None
         self.use_oauth = use_oauth
         self.allow_cache = allow_cache
+        self.hedger = hedger
+        self.timeout = timeout
 
         # Stored as epoch time
         self.expires = None
@@ -140,6 +157,7 @@ class InnerTube:
             "POST",
             headers={"Content-Type": "application/json"},
             data=data,
+            timeout=self.timeout,
         )
         response_data = json.loads(response.read())
 
@@ -160,6 +178,7 @@ class InnerTube:
             "POST",
             headers={"Content-Type": "application/json"},
             data=data,
+            timeout=self.timeout,
         )
         response_data = json.loads(response.read())
         verification_url = response_data["verification_url"]
@@ -178,6 +197,7 @@ class InnerTube:
             "POST",
             headers={"Content-Type": "application/json"},
             data=data,
+            timeout=self.timeout,
         )
         response_data = json.loads(response.read())
 
@@ -201,8 +221,12 @@ class InnerTube:
         """Return the base query parameters to transmit to the innertube API."""
         return {"key": self.api_key, "contentCheckOk": True, "racyCheckOk": True}
 
-    def _call_api(self, endpoint, query, data):
-        """Make a request to a given endpoint with the provided query parameters and data."""
+    def _call_api(self, endpoint, query, data, paths=None):
+        """Make a request to a given endpoint with the provided query parameters and data.
+
+        When ``paths`` is given, only those dotted key paths are extracted
+        and the response is not read further than needed.
+        """
         # Remove the API key if oauth is being used.
         if self.use_oauth:
             del query["key"]
@@ -210,6 +234,7 @@ class InnerTube:
         endpoint_url = f"{endpoint}?{parse.urlencode(query)}"
         headers = {
             "Content-Type": "application/json",
+            "Accept-Encoding": request.accept_encoding,
         }
         # Add the bearer token if applicable
         if self.use_oauth:
@@ -220,10 +245,25 @@ class InnerTube:
                 self.fetch_bearer_token()
                 headers["Authorization"] = f"Bearer {self.access_token}"
 
+        if self.hedger:
+            return self.hedger.call(
+                self._post,
+                endpoint_url,
+                headers,
+                data,
+                paths,
+                can_hedge=lambda: default_pool.has_free(endpoint_url),
+            )
+        return self._post(endpoint_url, headers, data, paths)
+
+    def _post(self, endpoint_url, headers, data, paths=None):
+        """Send a POST request to the API and parse the response."""
         response = request._execute_request(
-            endpoint_url, "POST", headers=headers, data=data
+            endpoint_url, "POST", headers=headers, data=data, timeout=self.timeout
         )
-        return json.loads(response.read())
+        if paths:
+            return request.read_json_paths(response, paths)
+        return json.loads(request.read_content(response))
 
     def browse(self):
         """Make a request to the browse endpoint.
@@ -261,11 +301,14 @@ class InnerTube:
         ...
         # return self._call_api(endpoint, query, self.base_data)  # noqa:E800
 
-    def player(self, video_id):
+    def player(self, video_id, paths=None):
         """Make a request to the player endpoint.
 
         :param str video_id:
             The video id to get player info for.
+        :param paths:
+            (Optional) Dotted key paths to extract instead of the whole result,
+            such as ``videoDetails.viewCount``.
         :rtype: dict
         :returns:
             Raw player info results.
@@ -275,7 +318,7 @@ class InnerTube:
             "videoId": video_id,
         }
         query.update(self.base_params)
-        return self._call_api(endpoint, query, self.base_data)
+        return self._call_api(endpoint, query, self.base_data, paths)
 
     def search(self, search_query, continuation=None):
         """Make a request to the search endpoint.
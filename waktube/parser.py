@@ -1,6 +1,8 @@
 import ast
+import codecs
 import json
 import re
+from typing import Any, Dict, Iterable
 from waktube.exceptions import HTMLParseError
 
 
@@ -183,3 +185,76 @@ def throttling_array_split(js_array):
             curr_substring = curr_substring[match_end:]
 
     return results
+
+
+def _set_path(result, keys, value):
+    for key in keys[:-1]:
+        result = result.setdefault(key, {})
+    result[keys[-1]] = value
+
+
+def parse_json_paths(chunks: Iterable[bytes], paths: Iterable[str]) -> Dict[str, Any]:
+    """Extract dotted key paths from a JSON object streamed in chunks.
+
+    Only the values of the requested top level keys are decoded, and chunks
+    stop being consumed once every one of them has been seen. Top level keys
+    are located by name, so the object must not contain the same key name
+    nested before its top level occurrence.
+
+    :param chunks:
+        UTF-8 encoded chunks of a JSON object.
+    :param paths:
+        Dotted key paths, such as ``videoDetails.viewCount``.
+    :rtype: dict
+    :returns:
+        A dict shaped like the source object, holding only the paths found.
+    """
+    wanted: Dict[str, list] = {}
+    for path in paths:
+        keys = path.split(".")
+        wanted.setdefault(keys[0], []).append(keys)
+
+    key_regex = re.compile(
+        r'"(%s)"\s*:' % "|".join(re.escape(key) for key in wanted)
+    )
+    # Longest possible partial key match to keep around between chunks.
+    overlap = max(len(key) for key in wanted) + 2
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    result: Dict[str, Any] = {}
+    buffer = ""
+    pending = None
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        while wanted:
+            if pending is None:
+                match = key_regex.search(buffer)
+                if match is None:
+                    buffer = buffer[-overlap:]
+                    break
+                pending = match.group(1)
+                buffer = buffer[match.end():]
+
+            start = json.decoder.WHITESPACE.match(buffer).end()
+            try:
+                value, end = decoder.raw_decode(buffer, start)
+            except json.JSONDecodeError:
+                # The value is not complete yet.
+                break
+            buffer = buffer[end:]
+
+            for keys in wanted.pop(pending):
+                nested = value
+                for key in keys[1:]:
+                    if not isinstance(nested, dict) or key not in nested:
+                        break
+                    nested = nested[key]
+                else:
+                    _set_path(result, keys, nested)
+            pending = None
+
+        if not wanted:
+            break
+
+    return result
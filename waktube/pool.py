@@ -0,0 +1,330 @@
+"""Thread-safe keep-alive connection pool used by :mod:`waktube.request`.
+
+``urlopen`` opens a new TCP (and TLS) connection for every request. Nearly all
+of waktube's traffic goes to a handful of hosts, so connections are kept open
+after a response has been read and handed to the next request for the same
+host instead.
+"""
+import http.client
+import io
+import logging
+import socket
+import ssl
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib import parse
+from urllib.error import HTTPError, URLError
+
+from waktube import hedge
+
+logger = logging.getLogger(__name__)
+
+_redirect_codes = (301, 302, 303, 307, 308)
+_max_redirects = 10
+
+# Errors raised when a kept-alive connection was closed by the server while
+# it sat idle in the pool.
+_stale_errors = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+PoolKey = Tuple[str, str, Optional[int]]
+
+
+def _pool_key(url: str) -> PoolKey:
+    split_url = parse.urlsplit(url)
+    return split_url.scheme.lower(), split_url.hostname, split_url.port
+
+
+def _abort(conn: http.client.HTTPConnection) -> None:
+    # Shutting the socket down wakes up a thread blocked reading from it.
+    if conn.sock is not None:
+        conn.sock.shutdown(socket.SHUT_RDWR)
+
+
+class PoolTimeoutError(URLError):
+    """No connection to a host was released within the pool's acquire timeout."""
+
+    def __init__(self, host: str, timeout: float):
+        super().__init__(f"no free connection to {host} within {timeout}s")
+        self.host = host
+        self.timeout = timeout
+
+
+class PooledResponse:
+    """Wrap an :class:`http.client.HTTPResponse` borrowed from a pool.
+
+    The underlying connection goes back to the pool as soon as the body has
+    been read to the end. Closing the response before that discards the
+    connection, because the unread body would corrupt the next response.
+    """
+
+    def __init__(
+        self,
+        pool: "ConnectionPool",
+        key: PoolKey,
+        conn: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+        url: str,
+        untrack: Callable[[], None],
+    ):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self._untrack = untrack
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        try:
+            data = self._response.read() if amt is None else self._response.read(amt)
+        except BaseException:
+            # A read that timed out or was cut off leaves the connection unusable.
+            self._response.close()
+            self._release(reusable=False)
+            raise
+        if self._response.isclosed():
+            self._release(reusable=not self._response.will_close)
+        return data
+
+    def info(self):
+        return self._response.msg
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getcode(self) -> int:
+        return self._response.status
+
+    def close(self) -> None:
+        if self._released:
+            return
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._release(reusable=reusable)
+
+    def _release(self, reusable: bool) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._untrack()
+        self._pool._release(self._key, self._conn, reusable)
+
+
+class ConnectionPool:
+    """Keep HTTP/1.1 connections alive between requests to the same host."""
+
+    def __init__(
+        self,
+        maxsize: int = 16,
+        idle_timeout: float = 30.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        acquire_timeout: Optional[float] = 60.0,
+    ):
+        """Construct a :class:`ConnectionPool <ConnectionPool>`.
+
+        :param int maxsize:
+            Maximum number of connections open to a single host at once.
+            Requests over the limit wait for a connection to be released.
+        :param float idle_timeout:
+            Seconds after which an unused connection is closed.
+        :param ssl.SSLContext ssl_context:
+            (Optional) Context used for https connections.
+        :param float acquire_timeout:
+            (Optional) Seconds a request waits for a connection over the
+            limit before failing with :class:`PoolTimeoutError`.
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._limits: Dict[PoolKey, threading.BoundedSemaphore] = {}
+        self._in_use: Dict[PoolKey, int] = {}
+
+        # Number of connections opened and number of requests served by an
+        # already open connection.
+        self.connections = 0
+        self.reused = 0
+
+    def _limit(self, key: PoolKey) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._limits:
+                self._limits[key] = threading.BoundedSemaphore(self.maxsize)
+            return self._limits[key]
+
+    def _new_connection(self, key: PoolKey, timeout) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        with self._lock:
+            self.connections += 1
+        if scheme == "https":
+            return http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(
+        self, key: PoolKey, timeout
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        if not self._limit(key).acquire(timeout=self.acquire_timeout):
+            raise PoolTimeoutError(key[1], self.acquire_timeout)
+        now = time.monotonic()
+        conn = None
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                candidate.close()
+
+        if conn is None:
+            return self._new_connection(key, timeout), False
+
+        if conn.sock is not None:
+            conn.sock.settimeout(
+                socket.getdefaulttimeout()
+                if timeout is socket._GLOBAL_DEFAULT_TIMEOUT
+                else timeout
+            )
+        conn.timeout = timeout
+        with self._lock:
+            self.reused += 1
+        return conn, True
+
+    def _release(
+        self, key: PoolKey, conn: http.client.HTTPConnection, reusable: bool
+    ) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append((conn, time.monotonic()))
+        else:
+            conn.close()
+        with self._lock:
+            self._in_use[key] -= 1
+        self._limit(key).release()
+
+    def has_free(self, url: str) -> bool:
+        """Return whether a request to the host of ``url`` would get a connection at once."""
+        key = _pool_key(url)
+        with self._lock:
+            return self._in_use.get(key, 0) < self.maxsize
+
+    def clear(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def _send(self, key: PoolKey, method, path, body, headers, timeout):
+        """Send a request, replacing kept-alive connections that went stale.
+
+        The connection is tracked by the hedged attempt sending it, if any,
+        so that it is aborted when that attempt loses.
+        """
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            untrack = hedge.track(partial(_abort, conn))
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn, conn.getresponse(), untrack
+            except _stale_errors as e:
+                untrack()
+                self._release(key, conn, reusable=False)
+                if not reused:
+                    raise URLError(e)
+                logger.debug("connection to %s went stale, reconnecting", key[1])
+            except OSError as e:
+                untrack()
+                self._release(key, conn, reusable=False)
+                raise URLError(e)
+            except BaseException:
+                untrack()
+                self._release(key, conn, reusable=False)
+                raise
+
+    def urlopen(
+        self,
+        url: str,
+        method: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        data: Optional[bytes] = None,
+        timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+    ) -> PooledResponse:
+        """Perform a request, following redirects like ``urlopen`` does.
+
+        :param str url:
+            The URL to request.
+        :param str method:
+            (Optional) HTTP method. Defaults to POST when data is given and GET
+            otherwise.
+        :param dict headers:
+            (Optional) Request headers.
+        :param bytes data:
+            (Optional) Request body.
+        :raises HTTPError:
+            For 4xx and 5xx responses.
+        :raises URLError:
+            When the connection fails.
+        """
+        method = method or ("POST" if data is not None else "GET")
+        headers = dict(headers or {})
+
+        for _ in range(_max_redirects + 1):
+            split_url = parse.urlsplit(url)
+            key = _pool_key(url)
+            path = split_url.path or "/"
+            if split_url.query:
+                path = f"{path}?{split_url.query}"
+
+            conn, response, untrack = self._send(key, method, path, data, headers, timeout)
+            pooled = PooledResponse(self, key, conn, response, url, untrack)
+            if method == "HEAD":
+                pooled.read()
+
+            location = response.getheader("Location")
+            if response.status in _redirect_codes and location:
+                pooled.read()
+                url = parse.urljoin(url, location)
+                if response.status in (301, 302, 303) and method not in ("GET", "HEAD"):
+                    method = "GET"
+                    data = None
+                    headers.pop("Content-Type", None)
+                continue
+
+            if response.status >= 400:
+                body = pooled.read()
+                raise HTTPError(
+                    url, response.status, response.reason, response.msg, io.BytesIO(body)
+                )
+
+            return pooled
+
+        raise HTTPError(url, response.status, "Too many redirects", response.msg, None)
+
+
+default_pool = ConnectionPool()
@@ -1,19 +1,169 @@
-"""Implements a simple wrapper around urlopen."""
+"""Implements a simple wrapper around a pooled urlopen."""
 import http.client
 import json
 import logging
 import re
 import socket
+import threading
+import urllib.request
+import zlib
+from collections import Counter
 from functools import lru_cache
+from typing import Dict, Iterator
 from urllib import parse
 from urllib.error import URLError
 from urllib.request import Request, urlopen
 
 from waktube.exceptions import RegexMatchError, MaxRetriesExceeded
-from waktube.helpers import regex_search
+from waktube.helpers import installed_proxies, regex_search
+from waktube.parser import parse_json_paths
+from waktube.pool import default_pool
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
 
 logger = logging.getLogger(__name__)
 default_range_size = 9437184  # 9MB
+default_chunk_size = 65536  # 64KB
+
+# Only advertised for text responses; ranged media downloads stay identity.
+accept_encoding = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+_transfer_lock = threading.Lock()
+_transfer = Counter()
+
+
+def transfer_stats() -> Dict[str, int]:
+    """Return the number of decoded responses and their total body size.
+
+    ``encoded_bytes`` is the size read off the wire and ``decoded_bytes``
+    the size after decompression.
+    """
+    with _transfer_lock:
+        return dict(_transfer)
+
+
+def _record_transfer(encoded, decoded):
+    with _transfer_lock:
+        _transfer["responses"] += 1
+        _transfer["encoded_bytes"] += encoded
+        _transfer["decoded_bytes"] += decoded
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self._decompressor.process(data)
+
+    def flush(self):
+        return b""
+
+
+def _decoder(content_encoding):
+    """Return an incremental decoder for a Content-Encoding, if one is needed."""
+    content_encoding = (content_encoding or "").strip().lower()
+    if content_encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if content_encoding == "deflate":
+        return zlib.decompressobj()
+    if content_encoding == "br" and brotli:
+        return _BrotliDecoder()
+    if content_encoding not in ("", "identity"):
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+    return None
+
+
+def iter_content(response, chunk_size=default_chunk_size) -> Iterator[bytes]:
+    """Read a response body in chunks, decoding its Content-Encoding.
+
+    :param response:
+        Response returned by :func:`_execute_request`.
+    :param int chunk_size:
+        Number of bytes read from the connection at a time.
+    :rtype: Iterable[bytes]
+    """
+    decoder = _decoder(response.info().get("Content-Encoding"))
+    encoded = decoded = 0
+    try:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            encoded += len(chunk)
+            if decoder:
+                chunk = decoder.decompress(chunk)
+            decoded += len(chunk)
+            if chunk:
+                yield chunk
+        if decoder:
+            chunk = decoder.flush()
+            decoded += len(chunk)
+            if chunk:
+                yield chunk
+    finally:
+        # Also runs when the caller stops reading early.
+        _record_transfer(encoded, decoded)
+
+
+def read_content(response) -> bytes:
+    """Read a whole response body, decoding its Content-Encoding.
+
+    :param response:
+        Response returned by :func:`_execute_request`.
+    :rtype: bytes
+    """
+    return b"".join(iter_content(response))
+
+
+def read_json_paths(response, paths, drain_limit=default_chunk_size):
+    """Read only as much of a JSON response as needed to extract ``paths``.
+
+    Once every path has been found the rest of the body is skipped. If at
+    most ``drain_limit`` bytes are left they are drained so the connection
+    can be reused; otherwise the response is closed.
+
+    :param response:
+        Response returned by :func:`_execute_request`.
+    :param paths:
+        Dotted key paths, see :func:`waktube.parser.parse_json_paths`.
+    :rtype: dict
+    """
+    chunks = iter_content(response)
+    try:
+        result = parse_json_paths(chunks, paths)
+    finally:
+        chunks.close()
+
+    remaining = response.length
+    if remaining is not None and remaining <= drain_limit:
+        response.read()
+    else:
+        response.close()
+    return result
+
+
+def _uses_proxy(url):
+    """Return whether urllib would send a request for ``url`` through a proxy.
+
+    That is the case for proxies installed with
+    :func:`install_proxy <waktube.helpers.install_proxy>`, and for those set
+    in the environment (``HTTP_PROXY``, ``HTTPS_PROXY``) unless ``NO_PROXY``
+    bypasses the host.
+
+    :param str url:
+        The URL of the request.
+    :rtype: bool
+    """
+    if installed_proxies():
+        return True
+    parts = parse.urlsplit(url)
+    return parts.scheme.lower() in urllib.request.getproxies() and not (
+        urllib.request.proxy_bypass(parts.hostname or "")
+    )
 
 
 def _execute_request(
@@ -30,11 +180,16 @@ def _execute_request(
         # encode data for request
         if not isinstance(data, bytes):
             data = bytes(json.dumps(data), encoding="utf-8")
-    if url.lower().startswith("http"):
-        request = Request(url, headers=base_headers, method=method, data=data)
-    else:
+    if not url.lower().startswith("http"):
         raise ValueError("Invalid URL")
-    return urlopen(request, timeout=timeout)  # nosec
+    # The connection pool connects directly, so proxied requests go through
+    # urllib's opener, which knows about the proxies.
+    if _uses_proxy(url):
+        request = Request(url, headers=base_headers, method=method, data=data)
+        return urlopen(request, timeout=timeout)  # nosec
+    return default_pool.urlopen(
+        url, method=method, headers=base_headers, data=data, timeout=timeout
+    )
 
 
 def get(url, extra_headers=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
@@ -50,8 +205,9 @@ def get(url, extra_headers=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
     """
     if extra_headers is None:
         extra_headers = {}
+    extra_headers.setdefault("Accept-Encoding", accept_encoding)
     response = _execute_request(url, headers=extra_headers, timeout=timeout)
-    return response.read().decode("utf-8")
+    return read_content(response).decode("utf-8")
 
 
 def post(url, extra_headers=None, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
@@ -76,13 +232,14 @@ def post(url, extra_headers=None, data=None, timeout=socket._GLOBAL_DEFAULT_TIME
     # required because the youtube servers are strict on content type
     # raises HTTPError [400]: Bad Request otherwise
     extra_headers.update({"Content-Type": "application/json"})
+    extra_headers.setdefault("Accept-Encoding", accept_encoding)
     response = _execute_request(
         url,
         headers=extra_headers,
         data=data,
         timeout=timeout
     )
-    return response.read().decode("utf-8")
+    return read_content(response).decode("utf-8")
 
 
 def seq_stream(
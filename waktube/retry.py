@@ -0,0 +1,153 @@
+"""Retry policy with exponential backoff for flaky YouTube requests."""
+import http.client
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional, TypeVar
+from urllib.error import HTTPError, URLError
+
+from waktube import exceptions
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errors that say something about the video itself, so asking again is pointless.
+PERMANENT_ERRORS = (exceptions.VideoUnavailable,)
+
+# Errors caused by the network or by YouTube throttling us.
+TRANSIENT_ERRORS = (
+    URLError,
+    OSError,
+    http.client.HTTPException,
+    exceptions.MaxRetriesExceeded,
+    exceptions.PlayerResponseError,
+)
+
+# HTTP status codes worth retrying.
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def is_throttled(error: BaseException) -> bool:
+    """Return whether ``error`` is YouTube pushing back rather than a failure.
+
+    :param BaseException error:
+        The error raised by the request.
+    :rtype: bool
+    """
+    if isinstance(error, HTTPError):
+        return error.code == 429
+    return isinstance(error, exceptions.PlayerResponseError)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Return whether a request that raised ``error`` is worth retrying.
+
+    :param BaseException error:
+        The error raised by the request.
+    :rtype: bool
+    """
+    if isinstance(error, PERMANENT_ERRORS):
+        return False
+    # HTTPError is a URLError, so it has to be checked first.
+    if isinstance(error, HTTPError):
+        return error.code in TRANSIENT_STATUS_CODES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class RetryPolicy:
+    """Retry transient failures with exponential backoff and full jitter.
+
+    The policy is meant to be shared by every request of a run: the retry
+    budget caps the number of retries across all of them, so a YouTube-wide
+    outage cannot turn into thousands of backoff loops, and no retry starts
+    past the run's deadline. Outcomes are counted in :attr:`counters` under
+    ``success``, ``retry``, ``permanent``, ``exhausted``,
+    ``budget_exhausted`` and ``deadline``, and throttled responses (HTTP 429,
+    bot checks) under ``throttled``. Retries after those wait at least half
+    the delay ceiling, so a throttled run actually slows down.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        budget: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ):
+        """Construct a :class:`RetryPolicy <RetryPolicy>`.
+
+        :param int max_attempts:
+            Maximum number of attempts per call, including the first one.
+        :param float base_delay:
+            Delay ceiling in seconds before the first retry. It doubles on
+            every following retry.
+        :param float max_delay:
+            Upper bound of the delay ceiling in seconds.
+        :param int budget:
+            (Optional) Total number of retries allowed across all calls.
+        :param float deadline:
+            (Optional) Epoch time after which calls fail instead of retrying.
+            A retry whose backoff would end past it is not attempted either.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.deadline = deadline
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def _take_retry(self) -> bool:
+        with self._lock:
+            if self.budget is not None and self.counters["retry"] >= self.budget:
+                return False
+            self.counters["retry"] += 1
+            return True
+
+    def delay(self, attempt: int, throttled: bool = False) -> float:
+        """Return the sleep time before retry number ``attempt`` (from 1)."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2 if throttled else 0, ceiling)  # nosec
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Call ``func``, retrying transient failures.
+
+        :raises:
+            The last error raised by ``func`` once it fails permanently, runs
+            out of attempts or time, or the retry budget is spent.
+        """
+        attempt = 1
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:  # noqa: B902
+                if not is_transient(e):
+                    self._count("permanent")
+                    raise
+                throttled = is_throttled(e)
+                if throttled:
+                    self._count("throttled")
+                if attempt >= self.max_attempts:
+                    self._count("exhausted")
+                    raise
+                delay = self.delay(attempt, throttled=throttled)
+                if self.deadline is not None and time.time() + delay >= self.deadline:
+                    self._count("deadline")
+                    raise
+                if not self._take_retry():
+                    self._count("budget_exhausted")
+                    raise
+                logger.debug("retrying after %s in %.2fs", e, delay)
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self._count("success")
+                return result
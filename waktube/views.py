@@ -0,0 +1,155 @@
+"""Lightweight view count lookups.
+
+Reading :attr:`YouTube.views <waktube.YouTube.views>` builds a full
+:class:`YouTube <waktube.YouTube>` object and a fresh
+:class:`InnerTube <waktube.innertube.InnerTube>` for every video. The helpers
+in this module only talk to the innertube player endpoint, sharing a single
+client between lookups.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, NoReturn, Optional, Tuple
+
+from waktube import exceptions
+from waktube.innertube import InnerTube
+
+logger = logging.getLogger(__name__)
+
+# The only parts of the player response needed to read the view count or to
+# tell why it is missing.
+view_count_paths = ("videoDetails.viewCount", "playabilityStatus")
+
+
+def parse_view_count(video_id: str, player_response: Dict) -> int:
+    """Extract the view count from a raw innertube player response.
+
+    :param str video_id:
+        The video id the response belongs to.
+    :param dict player_response:
+        Raw result of :meth:`InnerTube.player <waktube.innertube.InnerTube.player>`.
+    :rtype: int
+    :returns:
+        Number of times the video has been viewed.
+    :raises VideoUnavailable:
+        If the video itself cannot be viewed.
+    :raises PlayerResponseError:
+        If the response lacks the view count for another reason.
+    """
+    view_count = player_response.get("videoDetails", {}).get("viewCount")
+    if view_count is not None:
+        return int(view_count)
+
+    raise_for_playability(video_id, player_response.get("playabilityStatus", {}))
+
+
+def raise_for_playability(video_id: str, status_dict: Dict) -> NoReturn:
+    """Raise the error explaining why a player response has no video details.
+
+    Statuses are classified like :meth:`YouTube.check_availability
+    <waktube.YouTube.check_availability>` does. Anything else, such as a
+    bot check or a throttled response, raises
+    :class:`PlayerResponseError <waktube.exceptions.PlayerResponseError>`,
+    which is worth retrying.
+
+    :param str video_id:
+        The video id the response belongs to.
+    :param dict status_dict:
+        The ``playabilityStatus`` of the player response.
+    """
+    if "liveStreamability" in status_dict:
+        raise exceptions.LiveStreamError(video_id=video_id)
+
+    status = status_dict.get("status")
+    if "reason" in status_dict:
+        messages = [status_dict["reason"]]
+    else:
+        messages = status_dict.get("messages") or [None]
+
+    for reason in messages:
+        if status == "UNPLAYABLE":
+            if reason == (
+                "Join this channel to get access to members-only content "
+                "like this video, and other exclusive perks."
+            ):
+                raise exceptions.MembersOnly(video_id=video_id)
+            elif reason == "This live stream recording is not available.":
+                raise exceptions.RecordingUnavailable(video_id=video_id)
+            else:
+                raise exceptions.VideoUnavailable(video_id=video_id)
+        elif status == "LOGIN_REQUIRED":
+            if reason == (
+                "This is a private video. "
+                "Please sign in to verify that you may see it."
+            ):
+                raise exceptions.VideoPrivate(video_id=video_id)
+        elif status == "ERROR":
+            if reason == "Video unavailable":
+                raise exceptions.VideoUnavailable(video_id=video_id)
+        elif status == "LIVE_STREAM":
+            raise exceptions.LiveStreamError(video_id=video_id)
+
+    raise exceptions.PlayerResponseError(
+        video_id=video_id, status=status, reason=messages[0]
+    )
+
+
+def fetch_view_count(video_id: str, innertube: Optional[InnerTube] = None) -> int:
+    """Fetch the view count of a single video.
+
+    :param str video_id:
+        A YouTube video identifier.
+    :param InnerTube innertube:
+        (Optional) Client to reuse for the request.
+    :rtype: int
+    :returns:
+        Number of times the video has been viewed.
+    """
+    if innertube is None:
+        innertube = InnerTube()
+    return parse_view_count(
+        video_id, innertube.player(video_id, paths=view_count_paths)
+    )
+
+
+def fetch_view_counts(
+    video_ids: Iterable[str],
+    innertube: Optional[InnerTube] = None,
+    max_workers: int = 16,
+) -> Tuple[Dict[str, int], Dict[str, Exception]]:
+    """Fetch the view counts of many videos concurrently.
+
+    Each distinct id is requested once. Failures do not raise; they are
+    returned per id alongside the successful counts.
+
+    :param video_ids:
+        YouTube video identifiers.
+    :param InnerTube innertube:
+        (Optional) Client shared by every request.
+    :param int max_workers:
+        Maximum number of requests in flight.
+    :rtype: Tuple[Dict[str, int], Dict[str, Exception]]
+    :returns:
+        Mapping of video id to view count, and mapping of video id to the
+        error raised while fetching it.
+    """
+    if innertube is None:
+        innertube = InnerTube()
+    unique_ids = list(dict.fromkeys(video_ids))
+
+    def fetch(video_id: str) -> Tuple[str, Optional[int], Optional[Exception]]:
+        try:
+            return video_id, fetch_view_count(video_id, innertube), None
+        except Exception as e:  # noqa: B902
+            logger.debug("failed to fetch view count of %s: %s", video_id, e)
+            return video_id, None, e
+
+    views: Dict[str, int] = {}
+    errors: Dict[str, Exception] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for video_id, count, error in executor.map(fetch, unique_ids):
+            if error is None:
+                views[video_id] = count
+            else:
+                errors[video_id] = error
+
+    return views, errors